@@ -0,0 +1,345 @@
+""" Evaluate formulas for many rows of measurements without asking for any input.
+
+The data is a CSV file with a header or a JSON lines file (.jsonl) of objects.
+The column <name> holds the mean of variable <name> and <name>_error its error
+(0 if the column is missing).
+"""
+
+import csv
+import json
+from itertools import islice
+from math import nan, sqrt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from canonical import shrink
+from functions import (compile_source, function_source, gradient_source, hessian_source, simplified_derivative,
+                       simplified_hessian, variables)
+from parser import parse_function
+from persistent import formula_entry, program_entry, read_entry, read_program_entry
+from propagation import ErrorBudget
+
+ERROR_SUFFIX = '_error'
+UNDEFINED = (ValueError, ZeroDivisionError, OverflowError) # raised by math outside the domain of a formula
+
+
+def read_formulas(path):
+    """ Return the formulas of a file with one formula per line, skipping empty lines and lines starting with #. """
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def read_rows(path):
+    """ Yield one dictionary of column name to value per row of a CSV or JSON lines file.
+
+    The values are not converted, read_chunks() converts the columns which are needed.
+    """
+    with open(path, newline='') as f:
+        if path.endswith('.jsonl') or path.endswith('.json'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                yield {name.strip(): value for name, value in row.items() if name is not None}
+
+
+def _number(value, default):
+    """ Return value (str or number) as float, default if it is missing or empty. """
+    if value is None or isinstance(value, str) and not value.strip():
+        return default
+    return float(value)
+
+
+def read_chunks(rows, chunk_size, names=None):
+    """ Yield the number of rows and the columns of chunks of rows, dictionaries of column name to list of floats.
+
+    Errors missing or empty in a row are 0, means are nan.
+    Arguments:
+    rows -- iterable of dictionaries of column name to value, e.g. from read_rows()
+    chunk_size -- number of rows per chunk
+    names -- variables whose means and errors are converted, other columns are left out; all if None
+    """
+    wanted = None if names is None else set(names) | {name + ERROR_SUFFIX for name in names}
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        columns = dict.fromkeys(name for row in chunk for name in row if wanted is None or name in wanted)
+        yield len(chunk), {name: [_number(row.get(name), 0.0 if name.endswith(ERROR_SUFFIX) else nan) for row in chunk]
+               for name in columns}
+
+
+def propagate(value, names, partials, seconds, errors):
+    """ Return value and error of a formula from its value and derivatives at the means.
+
+    With second order, the value is shifted by the Hessian term 1/2 sum_i H_ii var_i and the
+    variance gets 1/2 sum_ij H_ij^2 var_i var_j added (independent normally distributed variables).
+    Arguments:
+    value -- value of the formula at the means
+    names -- names of the variables of the formula
+    partials -- partial derivatives by names
+    seconds -- second partial derivatives by names i <= j row by row (see functions.compile_hessian()),
+               None for first order
+    errors -- dictionary of variable name to error
+    """
+    if not names:
+        return value, 0 * value
+    square_sum = 0
+    for variable, partial in zip(names, partials):
+        square_sum = square_sum + (partial * errors[variable])**2
+    if seconds is not None:
+        variances = [errors[variable]**2 for variable in names]
+        seconds = iter(seconds)
+        shift = 0
+        for i in range(len(variances)):
+            for j in range(i, len(variances)):
+                second = next(seconds)
+                if i == j:
+                    shift = shift + second * variances[i] / 2
+                    square_sum = square_sum + (second * variances[i])**2 / 2
+                else: # H_ij and H_ji
+                    square_sum = square_sum + second**2 * variances[i] * variances[j]
+        value = value + shift
+    if numpy is not None:
+        return value, numpy.sqrt(square_sum)
+    return value, sqrt(square_sum)
+
+
+def load_formula(text, store=None, order=1):
+    """ Return the parsed and simplified function of text (may raise parser.ParseError) and its variables.
+
+    With store (persistent.FormulaStore) the function and its simplified derivatives (the second
+    ones too for order 2) are taken from there if present, else they are derived and written to it.
+    """
+    entry = store.load(text) if store is not None else None
+    if entry is not None:
+        function, names = read_entry(entry)
+        if order == 1 or 'seconds' in entry:
+            return function, names
+    else:
+        function = shrink(parse_function(text).simplify().simplify())
+        names = variables(function)
+    if store is not None:
+        partials = [simplified_derivative(function, name) for name in names]
+        store.store(text, formula_entry(function, names, partials, simplified_hessian(function, names) if order == 2 else None))
+    return function, names
+
+
+class Formula:
+    """ Formula parsed, derived and compiled once for evaluating many rows. """
+
+    def __init__(self, text, order=1):
+        """ Parse text (may raise parser.ParseError) and compile value and partial derivatives.
+
+        With order 2 the second partial derivatives are compiled too, see evaluate().
+        """
+        self.text = text
+        function, names = load_formula(text)
+        self.function = function
+        self.variables = names
+        arrays = numpy is not None
+        self.value = compile_source(function_source([function]), arrays=arrays)
+        self.gradient = compile_source(gradient_source(function, names), 'gradient', arrays) if names else None
+        self.hessian = compile_source(hessian_source(function, names), 'hessian', arrays) if order == 2 and names else None
+
+    def evaluate(self, means, errors):
+        """ Return value and propagated error for the means and errors (dictionaries of scalars or arrays), see propagate(). """
+        value = self.value(means)
+        if self.gradient is None:
+            return value, 0 * value
+        return propagate(value, self.variables, self.gradient(means), self.hessian(means) if self.hessian else None, errors)
+
+    def evaluate_chunk(self, columns, size):
+        """ Return lists of values and errors for a columnar chunk of size rows. """
+        missing = [name for name in self.variables if name not in columns]
+        if missing:
+            raise ValueError("missing column for variable " + ', '.join(missing))
+        zero = [0.0] * size
+        if numpy is not None:
+            means = {name: numpy.asarray(columns[name]) for name in self.variables}
+            errors = {name: numpy.asarray(columns.get(name + ERROR_SUFFIX, zero)) for name in self.variables}
+            value, error = self.evaluate(means, errors)
+            return numpy.broadcast_to(value, (size,)).tolist(), numpy.broadcast_to(error, (size,)).tolist()
+        values = list()
+        errors = list()
+        for i in range(size):
+            try:
+                value, error = self.evaluate({name: columns[name][i] for name in self.variables},
+                                             {name: columns.get(name + ERROR_SUFFIX, zero)[i] for name in self.variables})
+            except UNDEFINED: # nan like NumPy, one row outside the domain does not stop the others
+                value, error = nan, nan
+            values.append(value)
+            errors.append(error)
+        return values, errors
+
+
+class Program:
+    """ Formulas parsed, derived and compiled together into one function for evaluating many rows.
+
+    Equal subtrees are the same node (see functions.Interned), so a subexpression or partial
+    derivative used by several formulas is computed once per row for all of them.
+    """
+
+    def __init__(self, texts, store=None, order=1):
+        """ Parse the formula texts (may raise parser.ParseError) and compile values and derivatives of all.
+
+        Arguments:
+        texts -- list of formula strings
+        store -- persistent.FormulaStore to take the compiled program from or write it to, or None; on a miss
+                 the formulas are taken from it one by one, see load_formula()
+        order -- 2 for second order error propagation, see propagate()
+        """
+        self.texts = list(texts)
+        key = 'program ' + str(order) + '\n' + '\n'.join(self.texts) # formulas never contain newlines
+        entry = store.load(key) if store is not None else None
+        if entry is None:
+            functions, names = zip(*[load_formula(text, store, order) for text in self.texts]) if self.texts else ((), ())
+            source = program_source(functions, names, order)
+            if store is not None:
+                store.store(key, program_entry(functions, names, source))
+        else:
+            functions, names, source = read_program_entry(entry)
+        self.functions = list(functions)
+        self.names = list(names) # variables of each formula
+        self.variables = list(dict.fromkeys(name for formula_names in names for name in formula_names))
+        self.order = order
+        self.compiled = compile_source(source, 'program', numpy is not None)
+
+    def _outputs(self, means):
+        """ Return the values, the lists of partial derivatives and of second derivatives (None for first order)
+        of all formulas at the means.
+        """
+        outputs = iter(self.compiled(means))
+        values = [next(outputs) for _ in self.functions]
+        gradients = [[next(outputs) for _ in names] for names in self.names]
+        if self.order != 2:
+            return values, gradients, [None] * len(values)
+        return values, gradients, [[next(outputs) for _ in range(len(names) * (len(names) + 1) // 2)] for names in self.names]
+
+    def evaluate(self, means, errors):
+        """ Return the list of value and propagated error of every formula, see Formula.evaluate(). """
+        values, gradients, hessians = self._outputs(means)
+        return [propagate(value, names, partials, seconds, errors)
+                for value, names, partials, seconds in zip(values, self.names, gradients, hessians)]
+
+    def contributions(self, means, errors):
+        """ Return for every formula a dictionary of its variables to (partial derivative * error)^2, see
+        propagation.error_contributions().
+        """
+        _, gradients, _ = self._outputs(means)
+        return [{name: (partial * errors[name])**2 for name, partial in zip(names, partials)}
+                for names, partials in zip(self.names, gradients)]
+
+    def _evaluate_one(self, index, means, errors):
+        """ Return value and error of formula index without the compiled program, nan if it is undefined at the means. """
+        function, names = self.functions[index], self.names[index]
+        try:
+            partials = [simplified_derivative(function, name).evaluate(means) for name in names]
+            seconds = [second.evaluate(means) for second in simplified_hessian(function, names)] if self.order == 2 else None
+            return propagate(function.evaluate(means), names, partials, seconds, errors)
+        except UNDEFINED:
+            return nan, nan
+
+    def _check(self, columns):
+        missing = [name for name in self.variables if name not in columns]
+        if missing:
+            raise ValueError("missing column for variable " + ', '.join(missing))
+
+    def columns(self, columns, size):
+        """ Return means and errors (dictionaries of variable name to array) of a columnar chunk of size rows, needs NumPy. """
+        self._check(columns)
+        zero = numpy.zeros(size)
+        return ({name: numpy.asarray(columns[name]) for name in self.variables},
+                {name: numpy.asarray(columns.get(name + ERROR_SUFFIX, zero)) for name in self.variables})
+
+    def evaluate_chunk(self, columns, size):
+        """ Return lists of values and errors of every formula for a columnar chunk of size rows. """
+        if numpy is not None:
+            return [(numpy.broadcast_to(value, (size,)).tolist(), numpy.broadcast_to(error, (size,)).tolist())
+                    for value, error in self.evaluate(*self.columns(columns, size))]
+        self._check(columns)
+        zero = [0.0] * size
+        results = [([], []) for _ in self.functions]
+        for i in range(size):
+            means = {name: columns[name][i] for name in self.variables}
+            row_errors = {name: columns.get(name + ERROR_SUFFIX, zero)[i] for name in self.variables}
+            try:
+                rows = self.evaluate(means, row_errors)
+            except UNDEFINED: # find the formulas which are undefined at this row
+                rows = [self._evaluate_one(index, means, row_errors) for index in range(len(self.functions))]
+            for (values, errors), (value, error) in zip(results, rows):
+                values.append(value)
+                errors.append(error)
+        return results
+
+
+def program_source(functions, names, order=1):
+    """ Return the source of the function named program computing the values of all functions, then
+    their partial derivatives by their names, then with order 2 their second derivatives (see
+    functions.hessian_source()), one formula after the other.
+    """
+    roots = list(functions)
+    for function, formula_names in zip(functions, names):
+        roots += [simplified_derivative(function, name) for name in formula_names]
+    if order == 2:
+        for function, formula_names in zip(functions, names):
+            roots += simplified_hessian(function, formula_names)
+    if not roots:
+        return 'def program(replacements):\n    return ()\n'
+    source = function_source(roots, 'program')
+    if len(roots) == 1:
+        source = source[:-1] + ',\n'
+    return source
+
+
+def run_batch(formulas, rows, output, chunk_size=10000, store=None, order=1):
+    """ Write value and error of every formula for every row as CSV to output.
+
+    Arguments:
+    formulas -- list of formula strings
+    rows -- iterable of dictionaries of column name to value, e.g. from read_rows()
+    output -- writable text file
+    chunk_size -- number of rows evaluated at once
+    store -- persistent.FormulaStore to take parsed and derived formulas from, or None
+    order -- 2 for second order error propagation, see propagate()
+    """
+    program = Program(formulas, store, order)
+    writer = csv.writer(output, lineterminator='\n')
+    header = ['row']
+    for i in range(len(program.functions)):
+        header += ['value_' + str(i+1), 'error_' + str(i+1)]
+    writer.writerow(header)
+    row = 0
+    for size, columns in read_chunks(rows, chunk_size, program.variables):
+        results = program.evaluate_chunk(columns, size)
+        for i in range(size):
+            line = [row + i]
+            for values, errors in results:
+                line += [values[i], errors[i]]
+            writer.writerow(line)
+        row += size
+
+
+def run_budget(formulas, rows, output, chunk_size=10000, store=None, top=None):
+    """ Write which variables dominate the error of every formula over all rows as CSV to output, needs NumPy.
+
+    There is one line per formula and variable, largest mean share of the variance first, see
+    propagation.ErrorBudget. The arguments are those of run_batch(), top is the number of variables
+    written per formula (all if None).
+    """
+    program = Program(formulas, store)
+    budgets = [ErrorBudget(names) for names in program.names]
+    for size, columns in read_chunks(rows, chunk_size, program.variables):
+        for budget, contributions in zip(budgets, program.contributions(*program.columns(columns, size))):
+            budget.add(contributions)
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(['formula', 'rank', 'variable', 'mean_share', 'max_share', 'max_contribution', 'dominant', 'rows'])
+    for i, budget in enumerate(budgets):
+        for rank, line in enumerate(budget.ranking(top)):
+            writer.writerow([i+1, rank+1, line['variable'], line['mean_share'], line['max_share'],
+                             line['max_contribution'], line['dominant'], budget.rows])
@@ -0,0 +1,187 @@
+""" Benchmark the hot paths (parse, simplify, canonicalize, derivate, evaluate, tape, render, calculateError) on synthetic formulas.
+
+Run python benchmark.py [--output results.json] [--compare old.json]. Every case is
+timed on a fresh tree, so caches filled by a previous repetition do not count.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+import main
+from cache import derivatives
+from canonical import reduction
+from functions import postorder, variables
+from parser import parse_function
+from tape import Tape
+
+
+def flat_sum(size, variable_count):
+    """ Return a long flat sum of products like x0*1 + x1*2 + ... """
+    return ' + '.join('x' + str(i % variable_count) + '*' + str(i + 1) for i in range(size))
+
+
+def pow_quotient_chain(size, variable_count):
+    """ Return a deep chain of quotients and powers like ((x0/(x1+1))^2/(x2+2))^2 ... """
+    formula = 'x0'
+    for i in range(size):
+        formula = '(' + formula + '/(x' + str((i + 1) % variable_count) + '+' + str(i + 1) + '))^2'
+    return formula
+
+
+def trig_nest(size, variable_count):
+    """ Return nested sines and cosines like sin(x0*cos(x1*sin(x2 ...))) """
+    formula = 'x0'
+    for i in range(size):
+        function = 'sin' if i % 2 else 'cos'
+        formula = function + '(x' + str((i + 1) % variable_count) + '*' + formula + ')'
+    return formula
+
+
+EVALUATIONS = 10 # evaluate is timed on the same tree again, after the first call
+GENERATORS = {'flat_sum': flat_sum, 'pow_quotient_chain': pow_quotient_chain, 'trig_nest': trig_nest}
+DEFAULT_CASES = [
+    ('flat_sum', 200, 5), ('flat_sum', 2000, 20),
+    ('pow_quotient_chain', 10, 3), ('pow_quotient_chain', 40, 5),
+    ('trig_nest', 10, 3), ('trig_nest', 40, 5),
+]
+
+
+def run_case(formula, repeat):
+    """ Return the best time of every step over repeat runs on a fresh tree, and the node counts. """
+    names = None
+    timings = dict()
+    nodes = dict()
+    generator = random.Random(0)
+    for _ in range(repeat):
+        derivatives.clear()
+        gc.collect()
+        steps = dict()
+        start = time.perf_counter()
+        function = parse_function(formula)
+        steps['parse'] = time.perf_counter() - start
+        start = time.perf_counter()
+        function = function.simplify().simplify()
+        steps['simplify'] = time.perf_counter() - start
+        names = variables(function)
+        replacements = {name: generator.uniform(1, 2) for name in names}
+        errors = {name: 0.01 for name in names}
+        start = time.perf_counter()
+        partials = [function.derivate(name) for name in names]
+        steps['derivate'] = (time.perf_counter() - start) / max(len(names), 1)
+        start = time.perf_counter()
+        function.evaluate(replacements)
+        steps['evaluate_first'] = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(EVALUATIONS):
+            function.evaluate(replacements)
+        steps['evaluate'] = (time.perf_counter() - start) / EVALUATIONS
+        start = time.perf_counter()
+        str(function)
+        steps['str'] = time.perf_counter() - start
+        start = time.perf_counter()
+        function.prnt(replacements)
+        steps['prnt'] = time.perf_counter() - start
+        start = time.perf_counter()
+        canonical, _, canonical_nodes = reduction(function)
+        steps['canonicalize'] = time.perf_counter() - start
+        canonical.evaluate(replacements)
+        start = time.perf_counter()
+        for _ in range(EVALUATIONS):
+            canonical.evaluate(replacements)
+        steps['evaluate_canonical'] = (time.perf_counter() - start) / EVALUATIONS
+        start = time.perf_counter()
+        tape = Tape.from_function(function)
+        steps['tape'] = time.perf_counter() - start
+        stack = list()
+        start = time.perf_counter()
+        for _ in range(EVALUATIONS):
+            tape.evaluate(replacements, stack)
+        steps['evaluate_tape'] = (time.perf_counter() - start) / EVALUATIONS
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            main.calculateError(function, replacements, errors, latex=False)
+            steps['calculateError'] = time.perf_counter() - start
+            derivatives.clear()
+            start = time.perf_counter()
+            main.calculateError(function, replacements, errors)
+            steps['calculateError_latex'] = time.perf_counter() - start
+        for step, seconds in steps.items():
+            timings[step] = min(seconds, timings.get(step, seconds))
+        nodes = {'function': len(postorder(function)), 'canonical': canonical_nodes,
+                 'derivatives': len(postorder(*partials)), 'tape': len(tape)}
+        del function, partials, canonical, tape
+    derivatives.clear()
+    gc.collect()
+    return timings, nodes, len(names)
+
+
+def peak_memory(formula):
+    """ Return the peak memory in bytes of parsing, deriving and rendering formula once. """
+    derivatives.clear()
+    gc.collect()
+    tracemalloc.start()
+    function = parse_function(formula).simplify().simplify()
+    partials = [function.derivate(name).simplify().simplify() for name in variables(function)]
+    str(function)
+    [str(partial) for partial in partials]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del function, partials
+    return peak
+
+
+def run(cases, repeat):
+    """ Run all cases (list of (generator name, size, variable count)) and return the results as a dictionary. """
+    results = list()
+    for name, size, variable_count in cases:
+        formula = GENERATORS[name](size, variable_count)
+        timings, nodes, used = run_case(formula, repeat)
+        results.append({
+            'case': name, 'size': size, 'variables': used, 'length': len(formula),
+            'nodes': nodes, 'seconds': timings, 'peak_memory': peak_memory(formula),
+        })
+        print(name, size, ' '.join(step + '=' + format(seconds, '.2e') for step, seconds in timings.items()))
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(old, new):
+    """ Print the ratio new / old of every step of the cases present in both results. """
+    old_results = {(result['case'], result['size']): result for result in old['results']}
+    for result in new['results']:
+        before = old_results.get((result['case'], result['size']))
+        if before is None:
+            continue
+        ratios = [step + '=' + format(seconds / before['seconds'][step], '.2f')
+                  for step, seconds in result['seconds'].items() if before['seconds'].get(step)]
+        print(result['case'], result['size'], ' '.join(ratios))
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--output', default='benchmark_results.json', help="JSON file to write the results to")
+    arguments.add_argument('--compare', help="JSON file of an earlier run to compare with")
+    arguments.add_argument('--repeat', type=int, default=3, help="repetitions per case, the best time counts")
+    arguments.add_argument('--case', action='append', help="generator:size:variables, e.g. flat_sum:1000:10 (may be repeated)")
+    arguments = arguments.parse_args()
+    cases = DEFAULT_CASES
+    if arguments.case:
+        cases = [(case.split(':')[0], int(case.split(':')[1]), int(case.split(':')[2])) for case in arguments.case]
+    results = run(cases, arguments.repeat)
+    with open(arguments.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            compare(json.load(f), results)
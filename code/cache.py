@@ -0,0 +1,99 @@
+""" Contain caches to reuse derivatives and their renderings across calculations. """
+
+from collections import OrderedDict
+
+from canonical import shrink
+from functions import value_and_gradient, variables
+
+
+class LRUCache:
+    """ Dictionary holding at most maxsize entries, dropping the least recently used one first. """
+
+    def __init__(self, maxsize=1024):
+        """ Create a new empty cache.
+
+        Arguments:
+        maxsize -- maximum number of entries (int)
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """ Return the entry of key and mark it as recently used, or default if missing. """
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            return default
+        return self.entries[key]
+
+    def put(self, key, value):
+        """ Add or replace the entry of key, evicting the oldest entries if the cache is full. """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Derivative:
+    """ Simplified derivative of a function by one variable together with its rendering. """
+
+    def __init__(self, function, variable):
+        """ Derive function by variable (str) and render the result once. """
+        self.function = shrink(function.derivate(variable).simplify().simplify())
+        self.latex = str(self.function)
+
+
+class DerivativeCache(LRUCache):
+    """ Cache derivatives by (function, variable) and the last gradient by function.
+
+    Functions are interned, so the same formula parsed again later in the
+    session is the same object as long as the cache holds it and is not
+    derived again.
+    """
+
+    def derivative(self, function, variable):
+        """ Return the cached Derivative of function by variable, deriving it on a miss.
+
+        Arguments:
+        function -- function to derive
+        variable -- name of the variable (str)
+        """
+        key = (function, variable)
+        entry = self.get(key)
+        if entry is None:
+            entry = Derivative(function, variable)
+            self.put(key, entry)
+        return entry
+
+    def gradient(self, function, replacements):
+        """ Return all partial derivatives of function evaluated at replacements.
+
+        The result for the last values of the used variables is kept, so repeated
+        calculations with the same inputs skip the evaluation.
+        Arguments:
+        function -- function to derive
+        replacements -- dictionary of means
+        """
+        key = (function, None)
+        entry = self.get(key)
+        if entry is None:
+            entry = [variables(function), None, None]
+            self.put(key, entry)
+        used, values, gradient = entry
+        values_now = tuple(replacements[name] for name in used)
+        if values_now != values:
+            _, gradient = value_and_gradient(function, {name: replacements[name] for name in used})
+            entry[1:] = values_now, gradient
+        return {name: gradient.get(name, 0) for name in replacements}
+
+
+derivatives = DerivativeCache()
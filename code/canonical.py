@@ -0,0 +1,274 @@
+""" Bring functions into a canonical form with fewer nodes than simplify() reaches.
+
+Sums and products are flattened into n-ary lists. Like terms are collected (2*x + x*3 becomes
+5\\cdot x), and so are powers of the same base (x*x/y*x becomes x^3/y). Numeric coefficients
+are folded across nested products and mathematical constants (2*\\pi*3 becomes 6\\cdot \\pi).
+The result is built again from binary Sum, Difference, Product, Quotient and PowConstant
+nodes, so everything else (evaluation, derivation, compilation) works on it unchanged.
+
+Like simplify(), the rules assume a well defined function: x/x becomes 1 and 0*x becomes 0.
+"""
+
+from hashlib import blake2b
+from math import frexp, isfinite
+
+from functions import (Constant, Difference, MathConstant, Negate, PowConstant, Product, Quotient, Sum, Variable,
+                       _pending, postorder, powers_combine)
+
+SUMS = (Sum, Difference, Negate)
+PRODUCTS = (Product, Quotient, PowConstant)
+
+
+def _divide(coefficient, divisor):
+    """ Return coefficient / divisor if the quotient is exact, else None. """
+    if isinstance(coefficient, int) and isinstance(divisor, int):
+        if coefficient % divisor == 0:
+            return coefficient // divisor
+        return None
+    if abs(frexp(divisor)[0]) == 0.5: # dividing by a power of two is exact
+        return coefficient / divisor
+    return None
+
+
+def _digest(*parts):
+    """ Return a 64 bit integer identifying parts (numbers, strings and tuples of them), the same in every run. """
+    return int.from_bytes(blake2b(repr(parts).encode(), digest_size=8).digest(), 'big')
+
+
+def _order(node):
+    """ Return the sort key of a factor: numbers first, then constants, variables and other functions.
+
+    Keys are flat tuples, so comparing them never recurses into deep functions. Other functions
+    are ordered by class and then by a digest of their structure, built bottom up from the
+    digests of their children (the last item of every key) and cached.
+    """
+    key = node._cache.get('order')
+    if key is None:
+        for pending in _pending(node, 'order'):
+            if isinstance(pending, Constant):
+                value = pending.value
+                key = (0, value, _digest('Constant', float(value) if abs(value) < 1e300 else value)) # 2 and 2.0 alike
+            elif isinstance(pending, MathConstant):
+                key = (1, pending.name, _digest('MathConstant', pending.name))
+            elif isinstance(pending, Variable):
+                key = (2, pending.name, _digest('Variable', pending.name))
+            else:
+                children = pending.children()
+                name = type(pending).__name__
+                key = (3, name, _digest(name, tuple(child._cache['order'][-1] for child in children),
+                                        tuple(arg for arg in pending.args() if arg not in children)))
+            pending._cache['order'] = key
+        key = node._cache['order']
+    return key
+
+
+def _factors(function):
+    """ Return the numeric coefficient and a dictionary of base to exponent of a product.
+
+    Products, quotients, negations and powers with constant exponent of anything but products are looked through,
+    powers only where functions.powers_combine() allows it.
+    """
+    coefficient = 1
+    factors = dict()
+    stack = [(function, 1)]
+    while stack:
+        node, exponent = stack.pop()
+        integral = exponent == int(exponent)
+        if isinstance(node, Product) and integral:
+            stack.append((node.factor2, exponent))
+            stack.append((node.factor1, exponent))
+        elif isinstance(node, Quotient) and integral:
+            stack.append((node.divisor, -exponent))
+            stack.append((node.dividend, exponent))
+        elif isinstance(node, Negate) and integral:
+            coefficient *= (-1)**int(exponent)
+            stack.append((node.entry, exponent))
+        elif isinstance(node, PowConstant) and not powers_combine(node.exponent, exponent):
+            factors[node] = factors.get(node, 0) + exponent
+        elif isinstance(node, PowConstant) and not isinstance(node.base, (Product, Quotient, Negate)):
+            stack.append((node.base, exponent * node.exponent))
+        elif isinstance(node, PowConstant): # (a/b)^n is not spread into a^n/b^n, which overflows much earlier
+            factors[node.base] = factors.get(node.base, 0) + exponent * node.exponent
+        elif isinstance(node, Constant) and exponent == 1:
+            coefficient *= node.value
+        elif isinstance(node, Constant) and exponent == -1 and node.value != 0 and _divide(coefficient, node.value) is not None:
+            coefficient = _divide(coefficient, node.value)
+        elif isinstance(node, Constant) and integral and exponent > 0:
+            coefficient *= node.value ** int(exponent)
+        else:
+            factors[node] = factors.get(node, 0) + exponent
+    return coefficient, factors
+
+
+def _power(base, exponent):
+    if exponent == 1:
+        return base
+    return PowConstant(base, exponent)
+
+
+def _chain(nodes, operator):
+    """ Return the nodes combined left to right with the binary operator. """
+    result = nodes[0]
+    for node in nodes[1:]:
+        result = operator(result, node)
+    return result
+
+
+def _build_product(coefficient, factors):
+    """ Return the canonical function of coefficient times the product of base^exponent of factors. """
+    if coefficient == 0:
+        return Constant(0)
+    bases = sorted((base for base, exponent in factors.items() if exponent != 0), key=_order)
+    numerator = [_power(base, factors[base]) for base in bases if factors[base] > 0]
+    denominator = [_power(base, -factors[base]) for base in bases if factors[base] < 0]
+    if abs(coefficient) != 1 or not numerator:
+        numerator.insert(0, Constant(abs(coefficient)))
+    result = _chain(numerator, Product)
+    if denominator:
+        result = Quotient(result, _chain(denominator, Product))
+    if coefficient < 0:
+        return Negate(result)
+    return result
+
+
+def _terms(function):
+    """ Return a dictionary of monomial (canonical product without coefficient, None for the constant) to coefficient. """
+    terms = dict()
+    stack = [(function, 1)]
+    while stack:
+        node, sign = stack.pop()
+        if isinstance(node, Sum):
+            stack.append((node.summand2, sign))
+            stack.append((node.summand1, sign))
+        elif isinstance(node, Difference):
+            stack.append((node.subtrahend, -sign))
+            stack.append((node.minuend, sign))
+        elif isinstance(node, Negate):
+            stack.append((node.entry, -sign))
+        elif isinstance(node, Constant):
+            terms[None] = terms.get(None, 0) + sign * node.value
+        else:
+            coefficient, factors = _factors(node)
+            if not any(factors.values()):
+                terms[None] = terms.get(None, 0) + sign * coefficient
+                continue
+            monomial = _build_product(1, factors)
+            terms[monomial] = terms.get(monomial, 0) + sign * coefficient
+    return terms
+
+
+def _build_sum(terms):
+    """ Return the canonical function of the sum of coefficient * monomial of terms. """
+    constant = terms.pop(None, 0)
+    result = None
+    for monomial in sorted(terms, key=_order):
+        coefficient = terms[monomial]
+        if coefficient == 0:
+            continue
+        term = _build_product(abs(coefficient), _factors(monomial)[1])
+        if result is None:
+            result = term if coefficient > 0 else Negate(term)
+        elif coefficient > 0:
+            result = Sum(result, term)
+        else:
+            result = Difference(result, term)
+    if result is None:
+        return Constant(constant)
+    if constant > 0:
+        return Sum(result, Constant(constant))
+    if constant < 0:
+        return Difference(result, Constant(-constant))
+    return result
+
+
+def _canonical_node(node, children, flatten=True):
+    """ Return the canonical form of node given the canonical forms of its children.
+
+    Without flatten, sums and products are only rebuilt, their parent flattens them together.
+    """
+    if not children:
+        return node
+    if isinstance(node, PowConstant):
+        rebuilt = PowConstant(children[0], node.exponent)
+    else:
+        rebuilt = type(node)(*children)
+    if not isinstance(rebuilt, SUMS + PRODUCTS):
+        rebuilt = rebuilt.simplify()
+        if not rebuilt.variable_set() and not any(isinstance(n, MathConstant) for n in postorder(rebuilt)):
+            value = rebuilt.evaluate({})
+            if isinstance(value, (int, float)) and isfinite(value):
+                return Constant(value)
+    if not flatten:
+        return rebuilt
+    if isinstance(rebuilt, SUMS):
+        return _build_sum(_terms(rebuilt))
+    if isinstance(rebuilt, PRODUCTS):
+        coefficient, factors = _factors(rebuilt)
+        return _build_product(coefficient, factors)
+    return rebuilt
+
+
+def _cluster_roots(nodes):
+    """ Return the nodes which are not only used as part of a bigger sum or product. """
+    roots = {nodes[-1]}
+    for node in nodes:
+        kind = SUMS if isinstance(node, SUMS) else (Product, Quotient) if isinstance(node, (Product, Quotient)) else ()
+        for child in node.children():
+            if not isinstance(child, kind):
+                roots.add(child)
+    return roots
+
+
+def _canonical_pass(function):
+    """ Return the canonical form of every node of function once, bottom up.
+
+    Each sum or product is flattened once as a whole, not again for every binary node
+    it consists of. The results for these are cached per node.
+    """
+    result = function._cache.get('canonical')
+    if result is None:
+        nodes = postorder(function)
+        roots = _cluster_roots(nodes)
+        inner = dict()
+        for node in nodes:
+            if 'canonical' in node._cache:
+                continue
+            children = tuple(inner.get(child) or child._cache['canonical'] or child for child in node.children())
+            if node not in roots:
+                inner[node] = _canonical_node(node, children, False)
+                continue
+            canonical = _canonical_node(node, children)
+            node._cache['canonical'] = False if canonical is node else canonical # no reference cycle, as in simplify()
+        result = function._cache['canonical']
+    return result or function
+
+
+def canonicalize(function, passes=10):
+    """ Return the canonical form of function, applying the rules until nothing changes (at most passes times). """
+    for _ in range(passes):
+        result = _canonical_pass(function)
+        if result is function:
+            break
+        function = result
+    return function
+
+
+def node_count(function):
+    """ Return the number of distinct nodes of function. """
+    return len(postorder(function))
+
+
+def reduction(function):
+    """ Return the canonical form of function and the node counts before and after canonicalization. """
+    canonical = canonicalize(function)
+    return canonical, node_count(function), node_count(canonical)
+
+
+def shrink(function):
+    """ Return the canonical form of function unless it has more nodes than function.
+
+    Rebuilding flattened sums and products can lose sharing of subtrees between them,
+    so for some derivatives the canonical form is larger.
+    """
+    canonical, before, after = reduction(function)
+    return canonical if after <= before else function
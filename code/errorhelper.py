@@ -1,6 +1,19 @@
 """ This module helps to calculate an absolute error from given values. """
 
-from math import sqrt
+import argparse
+import csv
+import io
+import mmap
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from math import nan, sqrt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def calculate_mean_and_error(values: list):
     avg = sum(values)/len(values)
@@ -13,15 +26,299 @@ def calculate_mean_and_error(values: list):
     error_of_error = 1 / sqrt(2*(len(values)-1))
     print("Values:", values)
     print("Result:", avg, "+/-", error)
-    print("Variant:", variant, "- Derivation:", derivation, "- Error of error:", error_of_error)     
+    print("Variant:", variant, "- Derivation:", derivation, "- Error of error:", error_of_error)
     return avg, error
-    
-if __name__ == "__main__":
-    print("Enter your values seperated by space")
-    s = input()
-    l = list()
-    s = s.split(' ')
-    for v in s:
-        l.append(float(v))
-    calculate_mean_and_error(l)
 
+
+class RunningStatistics:
+    """ Count, mean and sum of squared deviations of values seen so far, in constant memory.
+
+    Chunks are added with the parallel algorithm of Chan et al., so statistics of
+    parts of a dataset can be computed separately and merged.
+    """
+
+    __slots__ = ('count', 'mean', 'square_sum')
+
+    def __init__(self, count=0, mean=0.0, square_sum=0.0):
+        self.count = count
+        self.mean = mean
+        self.square_sum = square_sum
+
+    def add(self, value):
+        """ Add a single value (Welford's algorithm). """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.square_sum += delta * (value - self.mean)
+
+    def add_chunk(self, values):
+        """ Add a sequence or array of values at once. """
+        if numpy is not None:
+            values = numpy.asarray(values, dtype=float)
+            if len(values) == 0:
+                return
+            mean = float(values.mean())
+            self.merge(RunningStatistics(len(values), mean, float(((values - mean)**2).sum())))
+            return
+        if len(values) == 0:
+            return
+        mean = sum(values) / len(values)
+        self.merge(RunningStatistics(len(values), mean, sum((val - mean)**2 for val in values)))
+
+    def merge(self, other):
+        """ Add the statistics of other (RunningStatistics) to self. """
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.square_sum += other.square_sum + delta**2 * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+
+    @property
+    def variant(self):
+        return self.square_sum / (self.count-1)
+
+    @property
+    def derivation(self):
+        return sqrt(self.variant)
+
+    @property
+    def error(self):
+        return self.derivation / sqrt(self.count)
+
+    @property
+    def error_of_error(self):
+        return 1 / sqrt(2*(self.count-1))
+
+
+def read_text_chunks(path, chunk_size=10**6):
+    """ Yield lists of at most chunk_size floats from a text file of whitespace separated values. """
+    chunk = list()
+    with open(path) as f:
+        for line in f:
+            chunk.extend(float(v) for v in line.split())
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = list()
+    if chunk:
+        yield chunk
+
+
+def read_binary_chunks(path, chunk_size=10**6):
+    """ Yield chunks of at most chunk_size values from a file of native 64 bit floats through a memory map.
+
+    With NumPy the chunks are arrays viewing the mapped file without copying, the map
+    is released once no chunk refers to it any more.
+    """
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    count = len(mapped) // 8
+    for start in range(0, count, chunk_size):
+        size = min(chunk_size, count - start)
+        if numpy is not None:
+            yield numpy.frombuffer(mapped, dtype=numpy.float64, count=size, offset=start*8)
+        else:
+            values = array('d')
+            values.frombytes(mapped[start*8:(start+size)*8])
+            yield values
+
+
+def calculate_mean_and_error_streaming(chunks):
+    """ Same as calculate_mean_and_error but for an iterable of chunks of values, in one pass.
+
+    Arguments:
+    chunks -- iterable of sequences of values, e.g. from read_text_chunks() or read_binary_chunks()
+    """
+    statistics = RunningStatistics()
+    for chunk in chunks:
+        statistics.add_chunk(chunk)
+    print("Values:", statistics.count)
+    print("Result:", statistics.mean, "+/-", statistics.error)
+    print("Variant:", statistics.variant, "- Derivation:", statistics.derivation, "- Error of error:", statistics.error_of_error)
+    return statistics.mean, statistics.error
+
+
+def csv_ranges(path, chunk_bytes=16 * 2**20):
+    """ Return the header (list of column names) of a CSV file and byte ranges (start, end) of about chunk_bytes
+    covering the lines after it.
+    """
+    with open(path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode()]), [])
+        start = f.tell()
+        size = f.seek(0, 2)
+    return [name.strip() for name in header], [(offset, min(offset + chunk_bytes, size)) for offset in range(start, size, chunk_bytes)]
+
+
+def read_csv_range(path, start, end):
+    """ Return the rows (lists of str) of a CSV file which start in the byte range from start to end.
+
+    A line crossing end belongs to this range, a line crossing start to the previous one, so
+    consecutive ranges read every line once. Fields must not contain line breaks.
+    """
+    with open(path, 'rb') as f:
+        f.seek(max(start - 1, 0))
+        if start > 0:
+            f.readline() # rest of the line of the previous range, or only its line break
+        lines = list()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            lines.append(line)
+    return list(csv.reader(io.StringIO(b''.join(lines).decode())))
+
+
+def _line_number(path, start, row):
+    """ Return the number (counted from 1) of row (counted from 0) of the byte range from start, see read_csv_range(). """
+    if start == 0:
+        return row + 1
+    lines = 0
+    with open(path, 'rb') as f:
+        left = start - 1
+        while left > 0:
+            block = f.read(min(left, 2**20))
+            if not block:
+                break
+            lines += block.count(b'\n')
+            left -= len(block)
+    return lines + 2 + row
+
+
+def group_statistics(path, start, end, group, columns, names=None):
+    """ Return a dictionary of (group, column index) to RunningStatistics of the rows of a CSV file in a byte range.
+
+    Empty fields are left out, and so are fields which are not numbers (like labels) unless names is given.
+    Arguments:
+    path, start, end -- file and byte range, see read_csv_range()
+    group -- index of the column with the group of a row, or None for one group ''
+    columns -- indices of the columns of values
+    names -- names of the columns, if given a field which is not a number raises ValueError naming column and line
+    """
+    values = dict()
+    for number, row in enumerate(read_csv_range(path, start, end)):
+        if not row:
+            continue
+        name = row[group] if group is not None else ''
+        lists = values.get(name)
+        if lists is None:
+            lists = values[name] = [list() for _ in columns]
+        for i, (index, column) in enumerate(zip(columns, lists)):
+            if index < len(row) and row[index].strip():
+                try:
+                    column.append(float(row[index]))
+                except ValueError:
+                    if names is not None:
+                        raise ValueError("field " + repr(row[index]) + " of column " + names[i] + " in line " +
+                                         str(_line_number(path, start, number)) + " of " + path + " is not a number")
+    statistics = dict()
+    for name, lists in values.items():
+        for index, column in zip(columns, lists):
+            statistics[(name, index)] = RunningStatistics()
+            statistics[(name, index)].add_chunk(column)
+    return statistics
+
+
+def calculate_grouped(path, group=None, columns=None, chunk_bytes=16 * 2**20, processes=None):
+    """ Return a dictionary of (group, column name) to RunningStatistics of the values in a CSV file with a header.
+
+    The file is read in byte ranges of about chunk_bytes, in parallel by a pool of processes,
+    and the statistics of the ranges are merged, so memory does not grow with the file.
+    Arguments:
+    path -- CSV file
+    group -- name of the column with the group of every row, all rows are one group '' if None
+    columns -- names of the columns to summarize (ValueError if they hold anything but numbers), if None all but group
+               which hold numbers, other fields are left out
+    chunk_bytes -- size of the ranges of the file handed to a process
+    processes -- number of processes, one per CPU if None, 1 runs everything in this process
+    """
+    header, ranges = csv_ranges(path, chunk_bytes)
+    for name in [group] + list(columns or []):
+        if name is not None and name not in header:
+            raise ValueError("no column " + name + " in " + path)
+    selected = columns is not None
+    if columns is None:
+        columns = [name for name in header if name != group]
+    indices = [header.index(name) for name in columns]
+    arguments = (group if group is None else header.index(group), indices, columns if selected else None)
+    if processes == 1 or len(ranges) <= 1:
+        parts = (group_statistics(path, start, end, *arguments) for start, end in ranges)
+        result = _merge_groups(parts, header)
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(group_statistics, path, start, end, *arguments) for start, end in ranges]
+            result = _merge_groups((future.result() for future in futures), header)
+    if not selected: # columns without any number, like labels
+        numeric = {column for (_, column), statistics in result.items() if statistics.count}
+        result = {key: statistics for key, statistics in result.items() if key[1] in numeric}
+    return result
+
+
+def _merge_groups(parts, header):
+    result = dict()
+    for part in parts:
+        for (name, index), statistics in part.items():
+            key = (name, header[index])
+            if key in result:
+                result[key].merge(statistics)
+            else:
+                result[key] = statistics
+    return result
+
+
+def write_table(statistics, output):
+    """ Write the result of calculate_grouped() as CSV to output, sorted by group and column.
+
+    Columns with less than two values have no variant, derivation, error and error of error (nan).
+    """
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(['group', 'column', 'count', 'mean', 'error', 'variant', 'derivation', 'error_of_error'])
+    for (name, column), entry in sorted(statistics.items()):
+        if entry.count < 2:
+            writer.writerow([name, column, entry.count, entry.mean if entry.count else nan, nan, nan, nan, nan])
+        else:
+            writer.writerow([name, column, entry.count, entry.mean, entry.error, entry.variant, entry.derivation,
+                             entry.error_of_error])
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('file', nargs='?', help="file of values separated by whitespace, asks for values if missing")
+    arguments.add_argument('--binary', action='store_true', help="file contains native 64 bit floats")
+    arguments.add_argument('--chunk-size', type=int, default=10**6, help="values processed at once")
+    arguments.add_argument('--csv', action='store_true',
+                           help="file is a CSV with a header, summarize every column (per group) as a table")
+    arguments.add_argument('--group', help="with --csv, column whose values group the rows")
+    arguments.add_argument('--columns', help="with --csv, comma separated columns to summarize (default all)")
+    arguments.add_argument('--processes', type=int, help="with --csv, number of processes (default one per CPU)")
+    arguments.add_argument('--chunk-bytes', type=int, default=16 * 2**20, help="with --csv, bytes of the file per process task")
+    arguments.add_argument('--output', help="with --csv, write the table to this file instead of stdout")
+    arguments = arguments.parse_args()
+    if arguments.csv:
+        if arguments.file is None:
+            sys.exit("ERROR --csv needs a file")
+        try:
+            result = calculate_grouped(arguments.file, arguments.group,
+                                       [name.strip() for name in arguments.columns.split(',')] if arguments.columns else None,
+                                       arguments.chunk_bytes, arguments.processes)
+        except ValueError as error:
+            sys.exit("ERROR " + str(error))
+        if arguments.output:
+            with open(arguments.output, 'w', newline='') as f:
+                write_table(result, f)
+        else:
+            write_table(result, sys.stdout)
+    elif arguments.file is None:
+        print("Enter your values seperated by space")
+        s = input()
+        l = list()
+        s = s.split(' ')
+        for v in s:
+            l.append(float(v))
+        calculate_mean_and_error(l)
+    elif arguments.binary:
+        calculate_mean_and_error_streaming(read_binary_chunks(arguments.file, arguments.chunk_size))
+    else:
+        calculate_mean_and_error_streaming(read_text_chunks(arguments.file, arguments.chunk_size))
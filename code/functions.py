@@ -2,17 +2,237 @@
 
 Each provides the following functionality:
 - __init__(arg, [arg2]) -- construct a new function of this type with the given value(s)
+- _derivate(variable) -- Return a function which should be identical to the 1st derivative by variable (variable is a str)
+- _simplify() -- Return a function which should do the same but in a less complex way.
+- children() -- Return a tuple of the argument functions (empty for constants and variables)
+- apply(*values) -- Return the value of this node given the values of its children
+- partials(*values) -- Return the derivatives of this node by each child given the values of its children
+- code(*names) -- Return Python source of this node given the variable names holding its children's values
+- parts() -- Return the LaTeX strings around and between the children (one more than children)
+Constants and variables provide __str__(), prnt(replacements) and evaluate(replacements) themselves.
+
+The base class Function builds the public operations on top of these without
+recursion, so the depth of a function is only limited by memory:
 - __str__() -- convert the function to algebraic representation
 - prnt(replacements) -- Return a string with the values inserted (replacements is a dict)
+- latex(replacements=None, limit=None) -- the same, optionally with large subtrees elided
 - evaluate(replacements) -- Return a double of the value at the specified values (replacements is a dict)
-- derivate(variable) -- Return a function which should be identical to the 1st derivative by variable (variable is a str)
-- simplify() -- Return a function which should do the same but in a less complex way.
+- derivate(variable), simplify() -- see _derivate() and _simplify()
 - contains(variable) -- Return whether the function makes any use of the variable (variable is a str)
+
+evaluate() also accepts NumPy arrays as replacements, see evaluate_batch().
+
+All functions are immutable and interned: constructing a function which is
+structurally equal to an existing one returns the existing object, so equal
+subtrees are shared and can be compared and hashed by identity. The base class
+Function memoizes derivate() and simplify() per node on top of _derivate()
+and _simplify(), and evaluate_many() and compile_gradient() compute every
+shared subexpression only once.
 """
-from math import log, inf, pi, e, cos, sin
+from math import log, inf, nan, pi, e, cos, sin
+from threading import Lock
+from weakref import WeakValueDictionary
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _is_array(value):
+    """ Return whether value is a NumPy array (False if NumPy is not installed). """
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+def _cos(value):
+    if _is_array(value):
+        return numpy.cos(value)
+    return cos(value)
+
+
+def _sin(value):
+    if _is_array(value):
+        return numpy.sin(value)
+    return sin(value)
+
+
+def _log(value):
+    if _is_array(value):
+        return numpy.log(value)
+    return log(value)
+
+
+def format_number(value):
+    """ Return value as LaTeX, e.g. 1.5\\cdot 10^{-05} for 1.5e-05. """
+    text = str(value)
+    if 'e' in text:
+        return text.replace('e', '\\cdot 10^{') + '}'
+    return text
+
+
+def powers_combine(inner, outer):
+    """ Return whether (u^inner)^outer equals u^(inner*outer) for every real u where the left side is defined.
+
+    This holds for an integer outer exponent or an odd inner exponent, not for ((-2)^2)^0.5.
+    """
+    return outer == int(outer) or (inner == int(inner) and int(inner) % 2 == 1)
+
+
+class Interned(type):
+    """ Metaclass returning the existing equal node instead of a new one. """
 
+    nodes = WeakValueDictionary()
+    lock = Lock()
 
-class Sum:
+    def __call__(cls, *args):
+        node = super().__call__(*args)
+        key = (cls,) + node.key()
+        with Interned.lock:
+            existing = Interned.nodes.get(key)
+            if existing is not None:
+                return existing
+            object.__setattr__(node, '_cache', dict())
+            Interned.nodes[key] = node
+        return node
+
+
+class Function(metaclass=Interned):
+    """ Base of all functions, immutable once constructed.
+    
+    _cache holds values derived from the node (e.g. compiled functions), it is
+    safe to share because the node never changes.
+    """
+
+    __slots__ = ('_cache', '__weakref__')
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError(type(self).__name__ + ' is immutable')
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError(type(self).__name__ + ' is immutable')
+
+    def args(self):
+        """ Return the arguments this node was constructed with. """
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def key(self):
+        """ Return a tuple identifying this node among the nodes of its class. """
+        return self.args()
+
+    def __reduce__(self):
+        if not self.children():
+            return type(self), self.args()
+        return _deserialize_one, (serialize(self),) # flat, deep trees would exceed the recursion limit
+
+    def evaluate(self, replacements):
+        plan = self._cache.get('plan')
+        if plan is None:
+            plan = _plan(self)
+            self._cache['plan'] = plan
+        steps, root_children = plan
+        values = list()
+        append = values.append
+        for method, children in steps:
+            if not children:
+                append(method(replacements))
+            elif len(children) == 2:
+                append(method(values[children[0]], values[children[1]]))
+            else:
+                append(method(values[children[0]]))
+        return self.apply(*[values[child] for child in root_children])
+
+    def variable_set(self):
+        """ Return the frozenset of the names of all variables used in the function, cached per node. """
+        found = self._cache.get('variables')
+        if found is None:
+            for node in _pending(self, 'variables'):
+                if isinstance(node, Variable):
+                    node._cache['variables'] = frozenset((node.name,))
+                    continue
+                found = EMPTY
+                for child in node.children():
+                    if not child._cache['variables'] <= found:
+                        found = found | child._cache['variables'] if found else child._cache['variables']
+                node._cache['variables'] = found
+            found = self._cache['variables']
+        return found
+
+    def contains(self, variable):
+        return variable in self.variable_set()
+
+    def derivate(self, variable):
+        """ Return the derivative by variable, derived only once per node and variable.
+        
+        Subtrees shared within and between derivatives are derived once, the result is a DAG.
+        The nodes are derived bottom up, so _derivate() finds the derivatives of the children cached.
+        """
+        key = ('derivate', variable)
+        derivative = self._cache.get(key)
+        if derivative is None:
+            if not self.contains(variable):
+                return Constant(0)
+            for node in _pending(self, key, variable):
+                node._cache[key] = node._derivate(variable)
+            derivative = self._cache[key]
+        return derivative
+
+    def simplify(self):
+        """ Return the simplified function, simplifying each node only once and bottom up. """
+        simplified = self._cache.get('simplify')
+        if simplified is None:
+            for node in _pending(self, 'simplify'):
+                simplified = node._simplify()
+                # remembering the node itself would be a reference cycle, which keeps the tree alive until a full collection
+                node._cache['simplify'] = False if simplified is node else simplified
+            simplified = self._cache['simplify']
+        return simplified or self
+
+    def __str__(self):
+        return self.latex()
+
+    def prnt(self, replacements):
+        return self.latex(replacements)
+
+    def latex(self, replacements=None, limit=None):
+        """ Return the LaTeX representation, with the values inserted if replacements (dict) is given.
+        
+        With limit, subtrees are elided as \\ldots so that the text is at most limit characters long.
+        Without replacements and limit the text of the function and of its shared subtrees is cached per node.
+        """
+        if replacements is None:
+            return _render(self, str, 'str' if limit is None else None, limit)
+        return _render(self, lambda leaf: leaf.prnt(replacements), None, limit)
+
+
+EMPTY = frozenset()
+
+
+def _pending(root, key, variable=None):
+    """ Return the nodes below root without key in their cache, children before parents.
+    
+    Nodes with key cached and, if variable is given, nodes not containing variable are not descended into.
+    """
+    nodes = list()
+    seen = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            nodes.append(node)
+            continue
+        if node in seen or key in node._cache or (variable is not None and not node.contains(variable)):
+            continue
+        seen.add(node)
+        stack.append((node, True))
+        for child in reversed(node.children()):
+            stack.append((child, False))
+    return nodes
+
+
+class Sum(Function):
+    __slots__ = ('summand1', 'summand2')
 
     def __init__(self, summand1, summand2):
         """Create a new sum.
@@ -23,72 +243,80 @@ class Sum:
         self.summand1 = summand1
         self.summand2 = summand2
         
-    def evaluate(self, replacements):
-        return summand1.evaluate(replacements) + summand2.evaluate(replacements)
+    def children(self):
+        return (self.summand1, self.summand2)
         
-    def derivate(self, variable):
-        if not self.summand1.contains(variable):
-            if not self.summand2.contains(variable):
-                return Constant(0)
-            return summand2.derivate(variable)
-        if not self.summand2.contains(variable):
-            return summand1.derivate(variable)
-        return self
+    def apply(self, summand1, summand2):
+        return summand1 + summand2
         
-    def simplify(self):
-        self.summand1 = self.summand1.simplify()
-        self.summand2 = self.summand2.simplify()
-        if isinstance(self.summand1, Constant):
-            if isinstance(self.summand2, Constant):
-                return Constant(self.summand1.value + self.summand2.value)
-            elif self.summand1.value == 0:
-                return self.summand2
-        elif isinstance(self.summand2, Constant) and self.summand2.value == 0:
-            return self.summand1
-        return self
+    def partials(self, summand1, summand2):
+        return 1, 1
         
-    def contains(self, variable):
-        return self.summand1.contains(variable) or self.summand2.contains(variable)
+    def code(self, summand1, summand2):
+        return summand1 + ' + ' + summand2
         
-    def __str__(self):
-        return '(' + str(self.summand1) + '+' + str(self.summand2) + ')'
+    def parts(self):
+        return '(', '+', ')'
         
-    def prnt(self, replacements):
-        return '(' + self.summand1.prnt(replacements) + '+' + self.summand2.prnt(replacements) + ')'
+    def _derivate(self, variable):
+        if not self.summand1.contains(variable):
+            if not self.summand2.contains(variable):
+                return Constant(0)
+            return self.summand2.derivate(variable)
+        if not self.summand2.contains(variable):
+            return self.summand1.derivate(variable)
+        return Sum(self.summand1.derivate(variable), self.summand2.derivate(variable))
+        
+    def _simplify(self):
+        summand1 = self.summand1.simplify()
+        summand2 = self.summand2.simplify()
+        if isinstance(summand1, Constant):
+            if isinstance(summand2, Constant):
+                return Constant(summand1.value + summand2.value)
+            elif summand1.value == 0:
+                return summand2
+        elif isinstance(summand2, Constant) and summand2.value == 0:
+            return summand1
+        return Sum(summand1, summand2)
 
 
-class Constant:
+class Constant(Function):
+    __slots__ = ('value',)
 
     def __init__(self, value: float):
         """Create a new constant with value."""
         self.value = value
         
+    def key(self):
+        return (repr(self.value),) # keep 1 and 1.0 apart
+        
     def evaluate(self, replacements):
         return self.value
         
-    def derivate(self, variable):
+    def children(self):
+        return ()
+        
+    def code(self):
+        return repr(self.value)
+        
+    def _derivate(self, variable):
         return Constant(0)
         
-    def simplify(self):
+    def _simplify(self):
         return self
         
-    def contains(self, variable):
-        return False
-        
     def __str__(self):
-        if 'e' in str(self.value):
-            return str(self.value).replace('e', '\\cdot 10^{') + '}'
-        return str(self.value)
+        return format_number(self.value)
         
     def prnt(self, replacements):
-        if 'e' in str(self.value):
-            return str(self.value).replace('e', '\\cdot 10^{') + '}'
-        return str(self.value)
+        return format_number(self.value)
 
 
-class MathConstant:
+class MathConstant(Function):
+    __slots__ = ('identifier', 'value', 'name')
 
     def __init__(self, name: str):
+        self.identifier = name
         if name == 'math.pi':
             self.value = pi
             self.name = '\\pi'
@@ -99,18 +327,24 @@ class MathConstant:
             self.value = 1 # should not be the case
             self.name = '<unknown constant>'
             
+    def args(self):
+        return (self.identifier,)
+            
     def evaluate(self, replacements):
         return self.value
         
-    def derivate(self, variable):
+    def children(self):
+        return ()
+        
+    def code(self):
+        return repr(self.value)
+        
+    def _derivate(self, variable):
         return Constant(0)
         
-    def simplify(self):
+    def _simplify(self):
         return self
         
-    def contains(self, variable):
-        return False
-        
     def __str__(self):
         return self.name
         
@@ -118,84 +352,105 @@ class MathConstant:
         return self.name # should display itself as pi, e, ...
 
 
-class Negate:
+class Negate(Function):
+    __slots__ = ('entry',)
 
     def __init__(self, entry):
         """ Create a negation of the function in entry. """
         self.entry = entry
         
-    def evaluate(self, replacements):
-        return -1 * self.entry.evaluate(replacements)
+    def children(self):
+        return (self.entry,)
         
-    def derivate(self, variable):
-        if not self.entry.contains(variable):
-            return Constant(0)
-        return Negate(self.entry.derivate(variable))
-    
-    def simplify(self):
-        self.entry = self.entry.simplify()
-        if isinstance(self.entry, Constant):
-            return Constant(-self.entry.value)
-        if isinstance(self.entry, Negate):
-            return self.entry.entry
-        return self
-        
-    def contains(self, variable):
-        return self.entry.contains(variable)
+    def apply(self, entry):
+        return -1 * entry
         
-    def __str__(self):
-        return '(-' + str(self.entry) + ')'
+    def partials(self, entry):
+        return -1,
         
-    def prnt(self, replacements):
-        return '(-' + self.entry.prnt(replacements) + ')'
+    def code(self, entry):
+        return '-' + entry
         
+    def parts(self):
+        return '(-', ')'
         
-class Difference:
+    def _derivate(self, variable):
+        if not self.entry.contains(variable):
+            return Constant(0)
+        return Negate(self.entry.derivate(variable))
+    
+    def _simplify(self):
+        entry = self.entry.simplify()
+        if isinstance(entry, Constant):
+            return Constant(-entry.value)
+        if isinstance(entry, Negate):
+            return entry.entry
+        return Negate(entry)
+
+
+class Difference(Function):
+    __slots__ = ('minuend', 'subtrahend')
 
     def __init__(self, minuend, subtrahend):
         """ Create a difference of the functions minuend, subtrahend. """
         self.minuend = minuend
         self.subtrahend = subtrahend
         
-    def evaluate(self, replacements):
-        return self.minuend.evaluate(replacements) - self.subtrahend.evaluate(replacements)
+    def children(self):
+        return (self.minuend, self.subtrahend)
         
-    def derivate(self, variable):
-        return Difference(self.minuend.derivate(variable), self.subtrahend.derivate(variable))
+    def apply(self, minuend, subtrahend):
+        return minuend - subtrahend
         
-    def simplify(self):
-        self.minuend = self.minuend.simplify()
-        self.subtrahend = self.subtrahend.simplify()
-        if isinstance(self.minuend, Constant):
-            if isinstance(self.subtrahend, Constant):
-                return Constant(self.minuend.value - self.subtrahend.value)
-            elif self.minuend.value == 0:
-                return Negate(self.subtrahend)
-        elif isinstance(self.subtrahend, Constant) and self.subtrahend.value == 0:
-            return self.minuend
-        return self
+    def partials(self, minuend, subtrahend):
+        return 1, -1
         
-    def contains(self, variable):
-        return self.minuend.contains(variable) or self.subtrahend.contains(variable)
+    def code(self, minuend, subtrahend):
+        return minuend + ' - ' + subtrahend
         
-    def __str__(self):
-        return '(' + str(self.minuend) + '-' + str(self.subtrahend) + ')'
+    def parts(self):
+        return '(', '-', ')'
         
-    def prnt(self, replacements):
-        return '(' + self.minuend.prnt(replacements) + '-' + self.subtrahend.prnt(replacements) + ')'
+    def _derivate(self, variable):
+        return Difference(self.minuend.derivate(variable), self.subtrahend.derivate(variable))
+        
+    def _simplify(self):
+        minuend = self.minuend.simplify()
+        subtrahend = self.subtrahend.simplify()
+        if isinstance(minuend, Constant):
+            if isinstance(subtrahend, Constant):
+                return Constant(minuend.value - subtrahend.value)
+            elif minuend.value == 0:
+                return Negate(subtrahend)
+        elif isinstance(subtrahend, Constant) and subtrahend.value == 0:
+            return minuend
+        return Difference(minuend, subtrahend)
 
 
-class Product:
+class Product(Function):
+    __slots__ = ('factor1', 'factor2')
 
     def __init__(self, factor1, factor2):
         """ Create a product with the functions factor1, factor2. """
         self.factor1 = factor1
         self.factor2 = factor2
         
-    def evaluate(self, replacements):
-        return self.factor1.evaluate(replacements)*self.factor2.evaluate(replacements)
+    def children(self):
+        return (self.factor1, self.factor2)
         
-    def derivate(self, variable):
+    def apply(self, factor1, factor2):
+        return factor1 * factor2
+        
+    def partials(self, factor1, factor2):
+        return factor2, factor1
+        
+    def code(self, factor1, factor2):
+        return factor1 + ' * ' + factor2
+        
+    def parts(self):
+        return '', '\\cdot ', ''
+        
+    def _derivate(self, variable):
         if not self.factor1.contains(variable):
             if not self.factor2.contains(variable):
                 return Constant(0)
@@ -204,124 +459,129 @@ class Product:
             return Product(self.factor1.derivate(variable), self.factor2)            
         return Sum(Product(self.factor1, self.factor2.derivate(variable)), Product(self.factor1.derivate(variable), self.factor2))
         
-    def simplify(self):
-        self.factor1 = self.factor1.simplify()
-        self.factor2 = self.factor2.simplify()
-        if isinstance(self.factor1, Constant):
-            if isinstance(self.factor2, Constant):
-                return Constant(self.factor1.value * self.factor2.value)
-            if self.factor1.value == 0:
-                return self.factor2
-            elif self.factor1.value == 1:
-                return self.factor2
-            elif self.factor1.value == -1:
-                return Negate(self.factor2)
-        elif isinstance(self.factor2, Constant):
-            if self.factor2.value == 0:
-                return self.factor1
-            elif self.factor2.value == 1:
-                return self.factor1
-            elif self.factor2.value == -1:
-                return Negate(self.factor1)
-        return self
-        
-    def contains(self, variable):
-        return self.factor1.contains(variable) or self.factor2.contains(variable)
-        
-    def __str__(self):
-        return str(self.factor1) + '\\cdot ' + str(self.factor2)
-        
-    def prnt(self, replacements):
-        return self.factor1.prnt(replacements) + '\\cdot ' + self.factor2.prnt(replacements)
-        
-        
-class Variable:
+    def _simplify(self):
+        factor1 = self.factor1.simplify()
+        factor2 = self.factor2.simplify()
+        if isinstance(factor1, Constant):
+            if isinstance(factor2, Constant):
+                return Constant(factor1.value * factor2.value)
+            if factor1.value == 0:
+                return Constant(0)
+            elif factor1.value == 1:
+                return factor2
+            elif factor1.value == -1:
+                return Negate(factor2)
+        elif isinstance(factor2, Constant):
+            if factor2.value == 0:
+                return Constant(0)
+            elif factor2.value == 1:
+                return factor1
+            elif factor2.value == -1:
+                return Negate(factor1)
+        return Product(factor1, factor2)
+
+
+class Variable(Function):
+    __slots__ = ('name',)
+
     def __init__(self, name: str):
         self.name = name
         
     def evaluate(self, replacements):
         return replacements[self.name]
         
-    def derivate(self, variable):
+    def children(self):
+        return ()
+        
+    def code(self):
+        return 'replacements[' + repr(self.name) + ']'
+        
+    def _derivate(self, variable):
         if variable == self.name:
             return Constant(1)
         return Constant(0)
         
-    def simplify(self):
+    def _simplify(self):
         return self
         
-    def contains(self, variable):
-        return self.name == variable
-        
     def __str__(self):
         return self.name
         
     def prnt(self, replacements):
-        s = str(replacements[self.name])
-        if 'e' in s:
-            return s.replace('e', '\\cdot 10^{') + '}'
-        return s
+        return format_number(replacements[self.name])
 
 
-class Cosine:
+class Cosine(Function):
+    __slots__ = ('entry',)
+
     def __init__(self, entry):
         """ Create the Cosine of the entry function. """
         self.entry = entry
         
-    def evaluate(self, replacements):
-        return cos(self.entry.evaluate(replacements))
+    def children(self):
+        return (self.entry,)
         
-    def derivate(self, variable):
-        if not self.entry.contains(variable):
-            return Constant(0)
-        return Product(Negate(Sine(self.entry)), self.entry.derivate(variable))
+    def apply(self, entry):
+        return _cos(entry)
         
-    def simplify(self):
-        self.entry = self.entry.simplify()
-        if isinstance(self.entry, Constant):
-            return Constant(cos(self.entry.value))
-        return self
+    def partials(self, entry):
+        return -_sin(entry),
         
-    def contains(self, variable):
-        return self.entry.contains(variable)
+    def code(self, entry):
+        return '_cos(' + entry + ')'
         
-    def __str__(self):
-        return '\\cos{(' + str(self.entry) + ')}'
+    def parts(self):
+        return '\\cos{(', ')}'
         
-    def prnt(self, replacements):
-        return '\\cos{(' + self.entry.prnt(replacements) + ')}'
+    def _derivate(self, variable):
+        if not self.entry.contains(variable):
+            return Constant(0)
+        return Product(Negate(Sine(self.entry)), self.entry.derivate(variable))
+        
+    def _simplify(self):
+        entry = self.entry.simplify()
+        if isinstance(entry, Constant):
+            return Constant(cos(entry.value))
+        return Cosine(entry)
+
 
+class Sine(Function):
+    __slots__ = ('entry',)
 
-class Sine:
     def __init__(self, entry):
         """ Create the sine of the entry function. """
         self.entry = entry
         
-    def evaluate(self, replacements):
-        return sin(self.entry.evaluate(replacements))
+    def children(self):
+        return (self.entry,)
         
-    def derivate(self, variable):
-        if not self.entry.contains(variable):
-            return Constant(0)
-        return Product(Cosine(self.entry), self.entry.derivate(variable))
+    def apply(self, entry):
+        return _sin(entry)
         
-    def simplify(self):
-        self.entry = self.entry.simplify()
-        if isinstance(self.entry, Constant):
-            return Constant(sin(self.entry.value))
-        return self
+    def partials(self, entry):
+        return _cos(entry),
         
-    def contains(self, variable):
-        return self.entry.contains(variable)
+    def code(self, entry):
+        return '_sin(' + entry + ')'
         
-    def __str__(self):
-        return '\\sin{(' + str(self.entry) + ')}'
+    def parts(self):
+        return '\\sin{(', ')}'
         
-    def prnt(self, replacements):
-        return '\\sin{(' + self.entry.prnt(replacements) + ')}'
-    
+    def _derivate(self, variable):
+        if not self.entry.contains(variable):
+            return Constant(0)
+        return Product(Cosine(self.entry), self.entry.derivate(variable))
+        
+    def _simplify(self):
+        entry = self.entry.simplify()
+        if isinstance(entry, Constant):
+            return Constant(sin(entry.value))
+        return Sine(entry)
+
+
+class PowConstant(Function):
+    __slots__ = ('base', 'exponent')
 
-class PowConstant:
     def __init__(self, base, exponent: float):
         """ Create a pow function with a constant exponent and a function as base. """
         self.base = base
@@ -329,10 +589,24 @@ class PowConstant:
             exponent = int(exponent)
         self.exponent = exponent # has to be a number
         
-    def evaluate(self, replacements):        
-        return self.base.evaluate(replacements) ** self.exponent
+    def children(self):
+        return (self.base,)
         
-    def derivate(self, variable):
+    def apply(self, base):
+        return base ** self.exponent
+        
+    def partials(self, base):
+        if self.exponent == 0:
+            return 0,
+        return self.exponent * base ** (self.exponent - 1),
+        
+    def code(self, base):
+        return base + ' ** ' + repr(self.exponent)
+        
+    def parts(self):
+        return '(', ')^{' + str(self.exponent) + '}'
+        
+    def _derivate(self, variable):
         if self.exponent == 0:
             return Constant(0)
         elif not self.base.contains(variable):
@@ -341,38 +615,47 @@ class PowConstant:
             return self.base.derivate(variable)
         return Product(Product(Constant(self.exponent), PowConstant(self.base, self.exponent-1)), self.base.derivate(variable))
         
-    def simplify(self):
-        self.base = self.base.simplify()
+    def _simplify(self):
+        base = self.base.simplify()
         if self.exponent == 0:
             return Constant(1)
-        elif isinstance(self.base, PowConstant):
-            return PowConstant(self.base.base, self.exponent + self.base.exponent)
+        elif isinstance(base, PowConstant) and powers_combine(base.exponent, self.exponent):
+            return PowConstant(base.base, self.exponent * base.exponent)
         elif self.exponent == 1:
-            return self.base
-        elif isinstance(self.base, Constant):
-            return Constant(self.base.value ** self.exponent)
-        return self
-            
-    def contains(self, variable):
-        return self.base.contains(variable)
-        
-    def __str__(self):
-        return '(' + str(self.base) + ')^{' + str(self.exponent) + '}'
-        
-    def prnt(self, replacements):
-        return '(' + self.base.prnt(replacements) + ')^{' + str(self.exponent) + '}'
+            return base
+        elif isinstance(base, Constant):
+            return Constant(base.value ** self.exponent)
+        return PowConstant(base, self.exponent)
 
 
-class Pow:
+class Pow(Function):
+    __slots__ = ('base', 'exponent')
+
     def __init__(self, base, exponent):
         """ Create the pow function of functions base, exponent (base ^ exponent)."""
         self.base = base
         self.exponent = exponent
         
-    def evaluate(self, replacements):
-        return self.base.evaluate(replacements) ** self.exponent.evaluate(replacements)
+    def children(self):
+        return (self.base, self.exponent)
         
-    def derivate(self, variable):
+    def apply(self, base, exponent):
+        return base ** exponent
+        
+    def partials(self, base, exponent):
+        if _is_array(base):
+            log_base = numpy.log(numpy.where(base > 0, base, 1))
+        else:
+            log_base = log(base) if base > 0 else 0 # only needed if the exponent is variable
+        return exponent * base ** (exponent - 1), base ** exponent * log_base
+        
+    def code(self, base, exponent):
+        return base + ' ** ' + exponent
+        
+    def parts(self):
+        return '(', ')^{', '}'
+        
+    def _derivate(self, variable):
         if (isinstance(self.base.simplify(), MathConstant) 
                 and self.base.simplify().name == 'e'):
             return Product(self, self.exponent.derivate(variable))
@@ -387,107 +670,513 @@ class Pow:
                         Product(Product(self.base, self.exponent.derivate(variable)),
                         Logarithm(self.base))))
                         
-    def simplify(self):
-        self.exponent = self.exponent.simplify()
-        self.base = self.base.simplify()
-        if isinstance(self.exponent, Constant):
-            return PowConstant(self.base, self.exponent.value).simplify()
-        if isinstance(self.base, Constant):
-            if self.base.value == 0:
+    def _simplify(self):
+        exponent = self.exponent.simplify()
+        base = self.base.simplify()
+        if isinstance(exponent, Constant):
+            return PowConstant(base, exponent.value).simplify()
+        if isinstance(base, Constant):
+            if base.value == 0:
                 return Constant(0)
-            elif self.base.value == 1:
+            elif base.value == 1:
                 return Constant(1)
-        if isinstance(self.exponent, Logarithm):
-            return self.exponent.entry
-        return self
-        
-    def contains(self, vaiable):
-        return self.exponent.contains(variable) or self.base.contains(variable)
-        
-    def __str__(self):
-        return '(' + str(self.base) + ')^{' + str(self.exponent) + '}'
-        
-    def prnt(self, replacements):
-        return '(' + self.base.prnt(replacements) + ')^{' + self.exponent.prnt(replacements) + '}'
-        
-        
-class Quotient:
+        if isinstance(exponent, Logarithm) and isinstance(base, MathConstant) and base.name == 'e':
+            return exponent.entry
+        return Pow(base, exponent)
+
+
+class Quotient(Function):
+    __slots__ = ('dividend', 'divisor')
+
     def __init__(self, dividend, divisor):
         """ Create a quotient of functions dividend, divisor. """
         self.dividend = dividend
         self.divisor = divisor
         
-    def evaluate(self, replacements):
-        return self.dividend.evaluate(replacements)/self.divisor.evaluate(replacements)
+    def children(self):
+        return (self.dividend, self.divisor)
         
-    def derivate(self, variable):
+    def apply(self, dividend, divisor):
+        return dividend / divisor
+        
+    def partials(self, dividend, divisor):
+        return 1 / divisor, -dividend / divisor ** 2
+        
+    def code(self, dividend, divisor):
+        return dividend + ' / ' + divisor
+        
+    def parts(self):
+        return '\\frac{', '}{', '}'
+        
+    def _derivate(self, variable):
         if not self.divisor.contains(variable):
             return Quotient(self.dividend.derivate(variable), self.divisor)
         elif not self.dividend.contains(variable):
             return Negate(Quotient(Product(self.dividend, self.divisor.derivate(variable)), PowConstant(self.divisor, 2)))
         return Quotient(Difference(Product(self.dividend.derivate(variable), self.divisor), Product(self.dividend, self.divisor.derivate(variable))), PowConstant(self.divisor, 2))
         
-    def simplify(self):
-        self.divisor = self.divisor.simplify()
-        self.dividend = self.dividend.simplify()
-        if isinstance(self.divisor, Constant) and self.divisor.value == 0:
+    def _simplify(self):
+        divisor = self.divisor.simplify()
+        dividend = self.dividend.simplify()
+        if isinstance(divisor, Constant) and divisor.value == 0:
             return Constant(inf) # mathematically incorrect, nvm
-        elif isinstance(self.dividend, Constant):
-            if self.dividend.value == 0:
+        elif isinstance(dividend, Constant):
+            if dividend.value == 0:
                 return Constant(0)
-            elif isinstance(self.divisor, Constant):
-                return Constant(self.dividend.value / self.divisor.value)
-            elif self.dividend.value == 1:
-                return PowConstant(self.divisor, -1)
-            elif self.dividend.value == -1:
-                return Negate(PowConstant(self.divisor, -1))
-        elif isinstance(self.divisor, Constant):
-            if self.divisor.simplify().value == 1:
-                return self.dividend
-            elif self.divisor.value == -1:
-                return Negate(self.dividend)
-        return self
-        
-    def contains(self, variable):
-        return self.dividend.contains(variable) or self.divisor.contains(variable)
-        
-    def __str__(self):
-        return "\\frac{" + str(self.dividend) + '}{' + str(self.divisor) + '}'
-        
-    def prnt(self, replacements):
-        return "\\frac{" + self.dividend.prnt(replacements) + '}{' + self.divisor.prnt(replacements) + '}'
+            elif isinstance(divisor, Constant):
+                return Constant(dividend.value / divisor.value)
+            elif dividend.value == 1:
+                return PowConstant(divisor, -1)
+            elif dividend.value == -1:
+                return Negate(PowConstant(divisor, -1))
+        elif isinstance(divisor, Constant):
+            if divisor.simplify().value == 1:
+                return dividend
+            elif divisor.value == -1:
+                return Negate(dividend)
+        return Quotient(dividend, divisor)
 
 
 # not supported
-class Logarithm:
+
+
+class Logarithm(Function):
+    __slots__ = ('entry',)
 
     def __init__(self, entry):
         """ Create the Logarithm of the entry function. """
         self.entry = entry
         
-    def evaluate(self, replacements):
-        return log(self.entry.evaluate(replacements))
+    def children(self):
+        return (self.entry,)
         
-    def derivate(self, variable):
-        return Quotient(self.entry.derivate(variable), self.entry)
+    def apply(self, entry):
+        return _log(entry)
         
-    def simplify(self):
-        self.entry = self.entry.simplify()
-        if isinstance(self.entry, Constant):
-            if self.entry.value > 0:
-                return Constant(log(self.entry.value))
-        if isinstance(self.entry, Pow) and isinstance(self.entry.base, MathConstant) and self.entry.base.name == 'e':
-            return self.entry.exponent        
-        return self
+    def partials(self, entry):
+        return 1 / entry,
         
-    def contains(self, variable):
-        return self.entry.contains(variable)
+    def code(self, entry):
+        return '_log(' + entry + ')'
         
-    def __str__(self):
-        return '\\log{' + str(self.entry) + '}'
+    def parts(self):
+        return '\\log{', '}'
         
-    def prnt(self, replacements):
-        return '\\log{' + self.entry.prnt(replacements) + '}'
+    def _derivate(self, variable):
+        return Quotient(self.entry.derivate(variable), self.entry)
+        
+    def _simplify(self):
+        entry = self.entry.simplify()
+        if isinstance(entry, Constant):
+            if entry.value > 0:
+                return Constant(log(entry.value))
+        if isinstance(entry, MathConstant) and entry.name == 'e':
+            return Constant(1)
+        if isinstance(entry, Pow) and isinstance(entry.base, MathConstant) and entry.base.name == 'e':
+            return entry.exponent        
+        return Logarithm(entry)
 
 
-        
+def serialize(*roots):
+    """ Return a flat, picklable representation of the roots: a list of (class, child indices, other arguments) in postorder and the root indices. """
+    index = dict()
+    entries = list()
+    for node in postorder(*roots):
+        children = node.children()
+        entries.append((type(node), tuple(index[child] for child in children), node.args()[len(children):]))
+        index[node] = len(index)
+    return entries, [index[root] for root in roots]
+
+
+def deserialize(data):
+    """ Return the list of roots of a representation returned by serialize(). """
+    entries, roots = data
+    nodes = list()
+    for cls, children, args in entries:
+        nodes.append(cls(*[nodes[child] for child in children], *args))
+    return [nodes[root] for root in roots]
+
+
+def _deserialize_one(data):
+    return deserialize(data)[0]
+
+
+def evaluate_batch(function, columns):
+    """ Evaluate function for many rows at once and return the values.
+    
+    With NumPy the whole tree is evaluated once with array operations and a
+    numpy.ndarray is returned, otherwise the rows are evaluated one by one
+    and a list is returned.
+    Arguments:
+    function -- function to evaluate
+    columns -- dictionary of variable name to a sequence of values (columnar table)
+               or a list of dictionaries (one per row)
+    """
+    if isinstance(columns, list) and not columns:
+        return numpy.zeros(0) if numpy is not None else []
+    if isinstance(columns, list):
+        columns = {name: [row[name] for row in columns] for name in (columns[0] if columns else {})}
+    if numpy is not None:
+        arrays = {name: numpy.asarray(values, dtype=float) for name, values in columns.items()}
+        rows = max((len(values) for values in arrays.values()), default=1)
+        return numpy.broadcast_to(function.evaluate(arrays), (rows,)).copy()
+    rows = max((len(values) for values in columns.values()), default=1)
+    return [function.evaluate({name: values[i] for name, values in columns.items()}) for i in range(rows)]
+
+
+def postorder(*roots):
+    """ Return a list of all distinct nodes below the roots, children before their parents. """
+    nodes = list()
+    seen = set()
+    stack = [(root, False) for root in reversed(roots)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            nodes.append(node)
+            continue
+        if node in seen:
+            continue
+        seen.add(node)
+        stack.append((node, True))
+        for child in reversed(node.children()):
+            if child not in seen:
+                stack.append((child, False))
+    return nodes
+
+
+def _lengths(root, leaf_text):
+    """ Return a dictionary of node to the length of its rendered text for all nodes below root. """
+    lengths = dict()
+    for node in postorder(root):
+        children = node.children()
+        if children:
+            lengths[node] = sum(len(part) for part in node.parts()) + sum(lengths[child] for child in children)
+        else:
+            lengths[node] = len(leaf_text(node))
+    return lengths
+
+
+ELLIPSIS = '\\ldots'
+
+
+def _reserve(node, lengths, room):
+    """ Return for every child of node the characters to keep for it if node is written into room characters,
+    the length of the children written in full, the shortest first, and of \\ldots for the others.
+    
+    Returns None if the parts of node do not fit or if of several children not even one can be written in full,
+    node is written as \\ldots then.
+    """
+    children = node.children()
+    free = room - sum(len(part) for part in node.parts()) - len(ELLIPSIS) * len(children)
+    reserves = [len(ELLIPSIS)] * len(children)
+    for i in sorted(range(len(children)), key=lambda i: lengths[children[i]]):
+        if lengths[children[i]] - len(ELLIPSIS) > free:
+            break
+        free -= lengths[children[i]] - len(ELLIPSIS)
+        reserves[i] = lengths[children[i]]
+    if free < 0 or len(children) > 1 and reserves == [len(ELLIPSIS)] * len(children):
+        return None
+    return reserves
+
+
+def _render(root, leaf_text, key=None, limit=None):
+    """ Return the LaTeX representation of root, written into one buffer.
+    
+    The position of every subtree in the buffer is remembered, so a subtree met again
+    is copied from there instead of being rendered again.
+    
+    Arguments:
+    leaf_text -- function returning the text of a constant or variable
+    key -- if given, the text of root and of subtrees met more than once is cached in their _cache under key
+    limit -- if given, the text is at most limit characters long (or \\ldots) and never longer than without limit:
+             a subtree not fitting into the characters left is written with some children elided as \\ldots,
+             see _reserve(), or as \\ldots
+    """
+    if key is not None:
+        text = root._cache.get(key)
+        if text is not None:
+            return text
+    lengths = _lengths(root, leaf_text) if limit is not None else None
+    out = list()
+    spans = dict()
+    written = 0
+    reserved = 0 # with limit, characters kept for the parts and subtrees on the stack
+    stack = [root if limit is None else [root, 0]] # with limit, subtrees are [node, characters kept for it]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            written += len(item)
+            reserved -= len(item)
+            continue
+        if isinstance(item, tuple): # end of a subtree
+            spans[item[0]] = (item[1], len(out))
+            continue
+        reserves = None
+        if lengths is not None:
+            item, kept = item
+            reserved -= kept
+            room = limit - written - reserved
+            if lengths[item] > room and lengths[item] > len(ELLIPSIS):
+                reserves = _reserve(item, lengths, room) if item.children() else None
+                if reserves is None:
+                    out.append(ELLIPSIS)
+                    written += len(ELLIPSIS)
+                    continue
+        children = item.children()
+        if not children:
+            text = leaf_text(item)
+        elif reserves is None and item in spans:
+            text = spans[item]
+            if not isinstance(text, str):
+                text = ''.join(out[text[0]:text[1]])
+                spans[item] = text
+                if key is not None:
+                    item._cache[key] = text
+        elif key is not None and key in item._cache:
+            text = item._cache[key]
+        else:
+            if reserves is None: # a subtree with elided children is not copied for a later occurrence
+                stack.append((item, len(out)))
+            parts = item.parts()
+            stack.append(parts[-1])
+            if lengths is None:
+                for child, part in zip(reversed(children), reversed(parts[:-1])):
+                    stack.append(child)
+                    stack.append(part)
+                continue
+            if reserves is None:
+                reserves = [lengths[child] for child in children]
+            for child, part, kept in zip(reversed(children), reversed(parts[:-1]), reversed(reserves)):
+                stack.append([child, kept])
+                stack.append(part)
+            reserved += sum(len(part) for part in parts) + sum(reserves)
+            continue
+        out.append(text)
+        written += len(text)
+    text = ''.join(out)
+    if key is not None:
+        root._cache[key] = text
+    return text
+
+
+def _plan(root):
+    """ Return the evaluation steps of root: (evaluate or apply method, child positions) per node below root
+    in postorder, and the positions of the children of root.
+    
+    root itself is left out, so caching the plan on root makes no reference cycle.
+    """
+    nodes = postorder(root)
+    index = {node: i for i, node in enumerate(nodes)}
+    steps = list()
+    for node in nodes[:-1]:
+        children = node.children()
+        steps.append((node.apply if children else node.evaluate, tuple(index[child] for child in children)))
+    return steps, tuple(index[child] for child in root.children())
+
+
+def variables(function):
+    """ Return the names of the variables used in function, in order of appearance. """
+    return list(dict.fromkeys(node.name for node in postorder(function) if isinstance(node, Variable)))
+
+
+def evaluate_many(roots, replacements):
+    """ Return the values of all roots, evaluating each distinct node below them only once.
+    
+    Works with NumPy arrays as replacements just like evaluate().
+    Arguments:
+    roots -- list of functions, e.g. the partial derivatives of one function
+    replacements -- dictionary of variable name to value
+    """
+    values = dict()
+    for node in postorder(*roots):
+        children = node.children()
+        if children:
+            values[node] = node.apply(*[values[child] for child in children])
+        else:
+            values[node] = node.evaluate(replacements)
+    return [values[root] for root in roots]
+
+
+def value_and_gradient(function, replacements):
+    """ Return the value and all partial derivatives of function in one forward and one backward sweep.
+    
+    Works with NumPy arrays as replacements just like evaluate().
+    Arguments:
+    function -- function to evaluate
+    replacements -- dictionary of variable name to value
+    Returns the value and a dictionary of variable name to partial derivative
+    (0 for variables in replacements which the function does not use).
+    """
+    nodes = postorder(function)
+    values = dict()
+    for node in nodes:
+        children = node.children()
+        if children:
+            values[id(node)] = node.apply(*[values[id(child)] for child in children])
+        else:
+            values[id(node)] = node.evaluate(replacements)
+    gradient = dict.fromkeys(replacements, 0)
+    adjoints = {id(function): 1.0}
+    for node in reversed(nodes):
+        adjoint = adjoints.pop(id(node), None)
+        if adjoint is None:
+            continue
+        if isinstance(node, Variable):
+            gradient[node.name] = gradient.get(node.name, 0) + adjoint
+            continue
+        children = node.children()
+        if not children:
+            continue
+        partials = node.partials(*[values[id(child)] for child in children])
+        for child, partial in zip(children, partials):
+            adjoints[id(child)] = adjoints.get(id(child), 0) + adjoint * partial
+    return values[id(function)], gradient
+
+
+def function_source(roots, name='compiled'):
+    """ Return the source of a Python function computing the values of all roots from a replacements dict.
+    
+    Every distinct inner node becomes one assignment, so nodes shared between the roots are computed once.
+    Constants are inlined and each variable is looked up once.
+    """
+    loads = dict()
+    lines = list()
+    names = dict()
+    for node in postorder(*roots):
+        children = node.children()
+        if isinstance(node, Variable):
+            if node.name not in loads:
+                loads[node.name] = ('v' + str(len(loads)), node.code())
+            names[id(node)] = loads[node.name][0]
+        elif not children:
+            names[id(node)] = '(' + node.code() + ')'
+        else:
+            names[id(node)] = 't' + str(len(lines))
+            lines.append('    ' + names[id(node)] + ' = ' + node.code(*[names[id(child)] for child in children]))
+    lines.append('    return ' + ', '.join(names[id(root)] for root in roots))
+    loads = ['    ' + local + ' = ' + code for local, code in loads.values()]
+    return '\n'.join(['def ' + name + '(replacements):'] + loads + lines) + '\n'
+
+
+def compile_source(source, name='compiled', arrays=False):
+    """ Execute the source returned by function_source() and return the function.
+    
+    Arguments:
+    source -- str of Python source or its code object from compile_code()
+    name -- name of the function defined in source
+    arrays -- whether the function will be called with NumPy arrays (uses math functions otherwise)
+    """
+    if arrays:
+        namespace = {'_cos': _cos, '_sin': _sin, '_log': _log}
+    else:
+        namespace = {'_cos': cos, '_sin': sin, '_log': log}
+    namespace.update(inf=inf, nan=nan)
+    if isinstance(source, str):
+        source = compile_code(source, name)
+    exec(source, namespace)
+    return namespace[name]
+
+
+def compile_code(source, name='compiled'):
+    """ Return the code object of the source returned by function_source(), which compile_source() also accepts. """
+    return compile(source, '<' + name + '>', 'exec')
+
+
+def compile_function(function, arrays=False):
+    """ Return a Python function computing function from a replacements dict, cached on function.
+    
+    Arguments:
+    function -- function to compile
+    arrays -- whether the compiled function should accept NumPy arrays in replacements
+    """
+    key = ('compiled', arrays)
+    compiled = function._cache.get(key)
+    if compiled is None:
+        compiled = compile_source(function_source([function]), arrays=arrays)
+        function._cache[key] = compiled
+    return compiled
+
+
+def compile_derivatives(function, variables, arrays=False):
+    """ Return a dictionary of variable name to a compiled function of the simplified partial derivative.
+    
+    The derivatives are cached on function, their compiled functions on the derivatives.
+    Arguments:
+    function -- function to derive
+    variables -- names of the variables (list of str)
+    arrays -- whether the compiled functions should accept NumPy arrays in replacements
+    """
+    return {variable: compile_function(simplified_derivative(function, variable), arrays) for variable in variables}
+
+
+def simplified_derivative(function, variable):
+    """ Return the simplified derivative of function by variable, cached on function. """
+    key = ('derivative', variable)
+    derivative = function._cache.get(key)
+    if derivative is None:
+        derivative = function.derivate(variable).simplify().simplify()
+        function._cache[key] = derivative
+    return derivative
+
+
+def compile_gradient(function, variables, arrays=False):
+    """ Return one compiled function returning the tuple of all simplified partial derivatives.
+    
+    Subexpressions shared between the partial derivatives are computed once per call.
+    Arguments:
+    function -- function to derive
+    variables -- names of the variables (list of str)
+    arrays -- whether the compiled function should accept NumPy arrays in replacements
+    """
+    key = ('gradient', tuple(variables), arrays)
+    compiled = function._cache.get(key)
+    if compiled is None:
+        compiled = compile_source(gradient_source(function, variables), 'gradient', arrays)
+        function._cache[key] = compiled
+    return compiled
+
+
+def gradient_source(function, variables):
+    """ Return the source of the function named gradient compiled by compile_gradient(). """
+    partials = [simplified_derivative(function, variable) for variable in variables]
+    source = function_source(partials, 'gradient')
+    if len(partials) == 1:
+        source = source[:-1] + ',\n' # return a tuple for a single variable, too
+    return source
+
+
+def compile_hessian(function, variables, arrays=False):
+    """ Return one compiled function returning the tuple of the simplified second partial derivatives.
+    
+    The Hessian is symmetric, so only the derivatives by variables i <= j are computed, row by row
+    (the upper triangle). They are derived from the cached first derivatives of simplified_derivative().
+    Arguments:
+    function -- function to derive
+    variables -- names of the variables (list of str)
+    arrays -- whether the compiled function should accept NumPy arrays in replacements
+    """
+    key = ('hessian', tuple(variables), arrays)
+    compiled = function._cache.get(key)
+    if compiled is None:
+        compiled = compile_source(hessian_source(function, variables), 'hessian', arrays)
+        function._cache[key] = compiled
+    return compiled
+
+
+def simplified_hessian(function, variables):
+    """ Return the simplified second partial derivatives by variables i <= j, row by row (the upper triangle).
+
+    They are derived from the cached first derivatives of simplified_derivative().
+    """
+    partials = [simplified_derivative(function, variable) for variable in variables]
+    return [simplified_derivative(partials[i], variables[j]) for i in range(len(variables)) for j in range(i, len(variables))]
+
+
+def hessian_source(function, variables):
+    """ Return the source of the function named hessian compiled by compile_hessian(). """
+    seconds = simplified_hessian(function, variables)
+    source = function_source(seconds, 'hessian')
+    if len(seconds) == 1:
+        source = source[:-1] + ',\n'
+    return source
@@ -0,0 +1,100 @@
+""" Re-evaluate a function and its error after single variables changed, recomputing only what they affect. """
+
+from math import sqrt
+
+from functions import Variable, postorder
+
+
+class IncrementalEvaluator:
+    """ Value, partial derivatives and propagated error of one function, kept up to date with its inputs.
+
+    The value and the local partial derivatives (Function.partials) of every node are
+    cached. When the mean of a variable changes only the nodes containing it are
+    evaluated again; when only its error changes nothing is evaluated, just its term
+    of the error sum is replaced.
+    """
+
+    def __init__(self, function):
+        """ Prepare function for evaluation, nothing is evaluated before the first update(). """
+        self.function = function
+        self.nodes = postorder(function)
+        index = {node: i for i, node in enumerate(self.nodes)}
+        self.children = [tuple(index[child] for child in node.children()) for node in self.nodes]
+        self.dependents = dict() # variable name -> positions of the nodes containing it, in postorder
+        for i, node in enumerate(self.nodes):
+            for name in node.variable_set():
+                self.dependents.setdefault(name, list()).append(i)
+        self.values = [None] * len(self.nodes)
+        self.locals = [None] * len(self.nodes)
+        self.means = dict()
+        self.errors = dict()
+        self.gradient = dict()
+        self.terms = dict() # variable name -> (partial derivative * error)^2
+        self.evaluated = 0 # nodes evaluated by the last update, for statistics
+
+    def variables(self):
+        """ Return the names of the variables the function uses. """
+        return list(self.dependents)
+
+    def update(self, replacements, error_replacements):
+        """ Bring value, gradient and error up to date with the means and errors and return value and error.
+
+        Arguments:
+        replacements -- dictionary of variable name to mean, must contain all variables of the function
+        error_replacements -- dictionary of variable name to error
+        """
+        changed = [name for name in self.dependents if self.means.get(name) != replacements[name]]
+        dirty = set()
+        for name in changed:
+            self.means[name] = replacements[name]
+            dirty.update(self.dependents[name])
+        if self.values[-1] is None: # first update, constants are evaluated too
+            dirty = range(len(self.nodes))
+        self._evaluate(sorted(dirty))
+        if dirty:
+            self._differentiate()
+        for name in self.dependents:
+            error = error_replacements[name]
+            if dirty or self.errors.get(name) != error:
+                self.errors[name] = error
+                self.terms[name] = (self.gradient[name] * error)**2
+        return self.value, self.error
+
+    def _evaluate(self, positions):
+        """ Evaluate the nodes at positions (in postorder) and their local partial derivatives. """
+        values = self.values
+        for i in positions:
+            node = self.nodes[i]
+            children = self.children[i]
+            if children:
+                arguments = [values[child] for child in children]
+                values[i] = node.apply(*arguments)
+                self.locals[i] = node.partials(*arguments)
+            else:
+                values[i] = node.evaluate(self.means)
+        self.evaluated = len(positions)
+
+    def _differentiate(self):
+        """ Accumulate the partial derivatives by every variable from the cached local ones (reverse mode). """
+        adjoints = [0] * len(self.nodes)
+        adjoints[-1] = 1.0
+        gradient = dict.fromkeys(self.dependents, 0)
+        for i in range(len(self.nodes) - 1, -1, -1):
+            adjoint = adjoints[i]
+            if adjoint == 0:
+                continue
+            node = self.nodes[i]
+            if isinstance(node, Variable):
+                gradient[node.name] += adjoint
+                continue
+            for child, partial in zip(self.children[i], self.locals[i] or ()):
+                adjoints[child] += adjoint * partial
+        self.gradient = gradient
+
+    @property
+    def value(self):
+        return self.values[-1]
+
+    @property
+    def error(self):
+        return sqrt(sum(self.terms.values()))
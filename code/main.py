@@ -1,7 +1,17 @@
+import argparse
+import os
+import sys
 from math import sqrt, pi
 from os import linesep
 
+import batch
+import persistent
+import service
+import sweep
+from cache import derivatives
 from functions import *
+from incremental import IncrementalEvaluator
+from montecarlo import monte_carlo
 from parser import parse, parse_variable
 
 
@@ -12,46 +22,93 @@ def calculateValue(function, replacements):
     return function.evaluate(replacements)
     
     
-def calculateError(function, replacements, error_replacements):
+def calculateContributions(function, replacements, error_replacements):
+    """ Return a dictionary of variable name to its contribution (partial derivative * error)^2 to the variance of function. """
+    gradient = derivatives.gradient(function, replacements)
+    return {variable: (gradient[variable]*error_replacements[variable])**2 for variable in replacements}
+
+
+def calculateError(function, replacements, error_replacements, latex=True):
+    """ Return the propagated error of function, printing the LaTeX representation and the share of every
+    variable in the variance if latex is set.
+    
+    All partial derivatives are evaluated numerically in one sweep (functions.value_and_gradient),
+    symbolic derivatives are only built for the LaTeX output. Both are cached in cache.derivatives.
+    """
+    contributions = calculateContributions(function, replacements, error_replacements)
+    s = sum(contributions.values())
+    if not latex:
+        return sqrt(s)
+    gradient = derivatives.gradient(function, replacements)
     print("Error calculations")
-    variables = replacements.keys()
-    s = 0
     c = list()
     d = list()
-    for variable in variables:
-        s += (function.derivate(variable).evaluate(replacements)*error_replacements[variable])**2
-        d.append('(' + str(function.derivate(variable).simplify().simplify()) + '\\cdot\\Delta ' + str(variable) + ')^2')
-        cv = str(function.derivate(variable).evaluate(replacements))
-        if 'e' in cv:
-            cv = cv.replace('e', '\\cdot 10^{') + '}'
-        cv2 = str(error_replacements[variable])
-        if 'e' in cv2:
-            cv2 = cv2.replace('e', '\\cdot 10^{') + '}'
-        c.append('(' + cv + '\\cdot ' + cv2 + ')^2')
-        print("$\\frac{\\partial}{\\partial "+ variable +"} = " + str(function.derivate(variable).simplify().simplify())+"$\\\\")
+    for variable in replacements:
+        derivative = derivatives.derivative(function, variable).latex
+        d.append('(' + derivative + '\\cdot\\Delta ' + str(variable) + ')^2')
+        c.append('(' + format_number(gradient[variable]) + '\\cdot ' + format_number(error_replacements[variable]) + ')^2')
+        print("$\\frac{\\partial}{\\partial "+ variable +"} = " + derivative +"$\\\\")
     print('Algebraic representation: \\\\ $\sqrt{\\begin{aligned}' + ' \\\\ + '.join(d) + '\\end{aligned}}$ \\\\')
     print('With numbers: \\\\ $\sqrt{\\begin{aligned}' + ' \\\\ + '.join(c) + '\\end{aligned}}$ \\\\')
+    if s > 0:
+        ranked = sorted(contributions.items(), key=lambda item: -item[1])
+        print('Shares of the variance: ' + ', '.join('$' + variable + '$ ' + format_number(100*contribution/s) + '\\%'
+                                                       for variable, contribution in ranked) + ' \\\\')
     return sqrt(s)
 
 
+def calculateMonteCarlo(function, replacements, error_replacements, samples=10**6, seed=None):
+    """ Print and return mean and standard deviation of function from normally distributed samples. """
+    result = monte_carlo(function, replacements, error_replacements, samples, seed)
+    print("Monte Carlo with " + str(result['samples']) + " samples (" + str(result['invalid']) + " left out outside the domain)")
+    for percentile, value in result['percentiles'].items():
+        print(str(percentile) + "% percentile: $" + str(value) + '$\\\\')
+    return result['mean'], result['std']
+
+
 def main_menu():
     replacements = {}
     error_replacements = {}
+    function = None
+    evaluator = None
     while True:
-        print("Enter function (command =) or define variable (command :) or quit (command q)")
+        print("Enter function (command =), define variable (command :), Monte Carlo of the function (command m) or quit (command q)")
         i = input()
         if i == '=':
-            print("Enter your function. Seperate arguments by brackets or spaces. Operators are + - * / ^ (only for constant exponents) sin cos log. Mathematical constants: math.pi, math.e")
+            print("Enter your function. Operators are + - * / ^ with the usual precedence, use brackets to group. Functions: sin cos log. Mathematical constants: math.pi, math.e")
             s = input()
             function, replacements, error_replacements = parse(s, replacements, error_replacements)
             function = function.simplify().simplify()
             print("Mean: "  + '$' + str(calculateValue(function, replacements)) + '$\\\\')
             print("Error: " + '$' + str(calculateError(function, replacements, error_replacements)) + '$\\\\')
+            evaluator = IncrementalEvaluator(function)
+            evaluator.update(replacements, error_replacements)
             print("Have fun at removing useless parts and cleaning formatting!")
         elif i == ':':
             print("What is the identifier of your variable?", end=' ')
             li = input()
             replacements, error_replacements = parse_variable(li, replacements, error_replacements)
+            if evaluator is not None and li in evaluator.dependents:
+                mean, error = evaluator.update(replacements, error_replacements)
+                print("Mean: " + '$' + str(mean) + '$\\\\')
+                print("Error: " + '$' + str(error) + '$\\\\')
+        elif i == 'm':
+            if function is None:
+                print("Enter a function first.")
+                continue
+            print("How many samples?", end=' ')
+            try:
+                samples = int(float(input()))
+            except ValueError:
+                print("That did not work, try again!")
+                continue
+            try:
+                mean, std = calculateMonteCarlo(function, replacements, error_replacements, samples)
+            except (ImportError, ValueError) as error:
+                print(error)
+                continue
+            print("Mean: " + '$' + str(mean) + '$\\\\')
+            print("Error: " + '$' + str(std) + '$\\\\')
         elif i == 'q':
             print("quit.")
             return None
@@ -59,9 +116,68 @@ def main_menu():
             print("Unrecognized command, try again.")
 
 
+def main(arguments):
+    """ Run the non-interactive modes selected by the command line arguments (list of str). """
+    parser = argparse.ArgumentParser(description="Calculate values and errors of functions. Without arguments, ask for everything interactively.")
+    parser.add_argument('--formula', action='append', default=[], help="function to calculate, may be repeated")
+    parser.add_argument('--formula-file', help="file with one function per line")
+    parser.add_argument('--data', help="CSV or JSON lines (.jsonl) file with columns <variable> and <variable>" + batch.ERROR_SUFFIX)
+    parser.add_argument('--output', help="file to write the results to instead of stdout, a .npz file for --sweep")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="rows evaluated at once")
+    parser.add_argument('--cache-dir', default=os.environ.get(persistent.CACHE_ENVIRONMENT),
+                        help="directory keeping parsed and derived formulas between runs (default $" + persistent.CACHE_ENVIRONMENT + ")")
+    parser.add_argument('--second-order', action='store_true',
+                        help="add the second derivative terms to value and error of --data and --sweep")
+    parser.add_argument('--budget', action='store_true',
+                        help="instead of the rows, write which variables dominate the error of --data (needs NumPy)")
+    parser.add_argument('--top', type=int, help="with --budget, the number of variables per formula (default all)")
+    parser.add_argument('--sweep', action='append', default=[], metavar='NAME=START:STOP:COUNT[,ERROR]',
+                        help="scan a variable over a range instead of reading --data, may be given twice for a grid")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=MEAN[,ERROR]', help="fixed variable of a sweep")
+    parser.add_argument('--serve', action='store_true', help="answer JSON lines requests on stdin/stdout, see service.py")
+    parser.add_argument('--socket', help="with --serve, listen on this Unix socket instead of stdin/stdout")
+    arguments = parser.parse_args(arguments)
+    if arguments.serve:
+        service.serve(arguments.socket)
+        return
+    formulas = list(arguments.formula)
+    if arguments.formula_file:
+        formulas += batch.read_formulas(arguments.formula_file)
+    if arguments.sweep:
+        if not formulas or not arguments.output:
+            parser.error("--sweep needs --formula or --formula-file and --output")
+        try:
+            fixed = [sweep.parse_fixed(text) for text in arguments.set]
+            result = sweep.sweep(formulas, [sweep.parse_range(text) for text in arguments.sweep],
+                                 {name: mean for name, mean, _ in fixed}, {name: error for name, _, error in fixed},
+                                 2 if arguments.second_order else 1)
+        except (ImportError, ValueError) as error:
+            sys.exit("ERROR " + str(error))
+        sweep.save_sweep(arguments.output, result)
+        return
+    if not formulas or not arguments.data:
+        parser.error("--formula or --formula-file and --data are required")
+    store = persistent.FormulaStore(arguments.cache_dir) if arguments.cache_dir else None
+    output = open(arguments.output, 'w', newline='') if arguments.output else sys.stdout
+    try:
+        if arguments.budget:
+            batch.run_budget(formulas, batch.read_rows(arguments.data), output, arguments.chunk_size, store, arguments.top)
+        else:
+            batch.run_batch(formulas, batch.read_rows(arguments.data), output, arguments.chunk_size, store,
+                            2 if arguments.second_order else 1)
+    except (ImportError, ValueError) as error:
+        sys.exit("ERROR " + str(error))
+    finally:
+        if arguments.output:
+            output.close()
+
+
 if __name__=="__main__":
     
-    main_menu()
+    if len(sys.argv) > 1:
+        main(sys.argv[1:])
+    else:
+        main_menu()
     
 
 
@@ -0,0 +1,94 @@
+""" Propagate errors by sampling the variables instead of linearizing the function (needs NumPy). """
+
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from os import cpu_count
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from errorhelper import RunningStatistics
+from functions import compile_function, variables
+
+
+def _simulate_chunk(function, means, errors, size, seed, keep):
+    """ Evaluate function for one chunk of normally distributed samples.
+
+    Returns the RunningStatistics of the finite values, a copy of the first keep values, which are a random subset because the samples are independent,
+    and the number of samples outside the domain of function (e.g. log of negative numbers).
+    """
+    generator = numpy.random.default_rng(seed)
+    samples = {name: generator.normal(means[name], errors[name], size) for name in means}
+    with numpy.errstate(all='ignore'):
+        values = numpy.broadcast_to(compile_function(function, arrays=True)(samples), (size,))
+    values = values[numpy.isfinite(values)]
+    statistics = RunningStatistics()
+    statistics.add_chunk(values)
+    return statistics, values[:keep].copy(), size - len(values)
+
+
+def monte_carlo(function, replacements, error_replacements, samples=10**6, seed=None,
+                chunk_size=10**6, processes=None, percentiles=(2.5, 16, 50, 84, 97.5), keep=10**6):
+    """ Return mean, standard deviation and percentiles of function for normally distributed variables.
+
+    The samples are drawn and evaluated in chunks, so memory does not grow with samples. Every
+    chunk has its own random stream derived from seed, the result only depends on seed and
+    chunk_size but not on processes.
+    Arguments:
+    function -- function to evaluate
+    replacements -- dictionary of means
+    error_replacements -- dictionary of errors (standard deviations)
+    samples -- total number of samples (int)
+    seed -- int for reproducible results, None for fresh randomness
+    chunk_size -- number of samples evaluated at once
+    processes -- number of worker processes, None for one per core
+    percentiles -- percentiles to report (in percent)
+    keep -- maximum number of values kept to estimate the percentiles
+    Returns a dictionary with mean, std, samples, percentiles (dictionary of percentile to value)
+    and invalid (number of samples giving no finite value, which are left out).
+    """
+    if numpy is None:
+        raise ImportError("Monte Carlo error propagation needs NumPy")
+    if samples < 1:
+        raise ValueError("Monte Carlo needs at least one sample")
+    used = variables(function)
+    means = {name: replacements[name] for name in used}
+    errors = {name: error_replacements[name] for name in used}
+    sizes = [chunk_size] * (samples // chunk_size)
+    if samples % chunk_size:
+        sizes.append(samples % chunk_size)
+    seeds = numpy.random.SeedSequence(seed).spawn(len(sizes))
+    keeps = [ceil(size * min(keep, samples) / samples) for size in sizes]
+    arguments = ([function] * len(sizes), [means] * len(sizes), [errors] * len(sizes), sizes, seeds, keeps)
+    if processes is None:
+        processes = cpu_count() or 1
+    if processes == 1 or len(sizes) == 1:
+        chunks = map(_simulate_chunk, *arguments)
+        return _summarize(chunks, percentiles)
+    with ProcessPoolExecutor(processes) as executor:
+        return _summarize(executor.map(_simulate_chunk, *arguments), percentiles)
+
+
+def _summarize(chunks, percentiles):
+    """ Merge the chunk results in order and compute the summary of monte_carlo(). """
+    statistics = RunningStatistics()
+    invalid = 0
+    kept = list()
+    for chunk_statistics, chunk_kept, chunk_invalid in chunks:
+        statistics.merge(chunk_statistics)
+        kept.append(chunk_kept)
+        invalid += chunk_invalid
+    kept = numpy.concatenate(kept)
+    if len(kept):
+        values = numpy.percentile(kept, percentiles).tolist()
+    else:
+        values = [float('nan')] * len(percentiles)
+    return {
+        'samples': statistics.count,
+        'invalid': invalid,
+        'mean': statistics.mean,
+        'std': statistics.derivation if statistics.count > 1 else 0.0,
+        'percentiles': dict(zip(percentiles, values)),
+    }
@@ -1,45 +1,30 @@
 """ Contain some function to convert an input string to usable mathematical constructs. """
 
-from math import sqrt, pi
-import sys
+import re
 
 from functions import *
 
 
-class structure:
-    """ Element to create the parsing tree."""
-    def __init__(self):
-        """ Create a new structure with a list of deeper level entries. """
-        self.li = list()
-        self.counter = -1
-    def append(self, item, depth):
-        """ Add the new item to this level or pass it to deeper levels if depth > 0.
-        
-        Arguments:
-        item -- str or structure
-        depth -- how far the item should be passed into the tree, 0 if to be appended here.
-        """
-        if isinstance(item, str) and len(item) == 0:
-            pass
-        elif depth == 0:
-            self.counter += 1
-            self.li.append(item)
-        else:
-            self.li[self.counter].append(item, depth-1)
-    def return_as_list(self):
-        """ Convert self to a nested list and return that. """
-        li = list()
-        if len(self.li) == 1:
-            if isinstance(self.li[0], structure):
-                return self.li[0].return_as_list()
-        for item in self.li:
-            if isinstance(item, structure):
-                li.append(item.return_as_list())
-            else:
-                li.append(item)
-        return li
-        
-  
+TOKEN = re.compile(r"""\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?(?![^\s()+\-*/^]))
+    |(?P<operator>[()+\-*/^])
+    |(?P<name>[^\s()+\-*/^]+)
+    )""", re.VERBOSE)
+
+# binding power of the binary operators, higher binds stronger
+BINARY = {'+': 10, '-': 10, '*': 20, '/': 20, '^': 40}
+RIGHT_ASSOCIATIVE = ('^',)
+# prefix operators bind stronger than * and / but weaker than ^: -x^2 = -(x^2), sin x^2 = sin(x^2),
+# a function directly followed by a bracket is one operand: sin(x)^2 = (sin(x))^2
+PREFIX_POWER = 30
+FUNCTIONS = {'sin': Sine, 'cos': Cosine, 'log': Logarithm}
+MATH_CONSTANTS = ('math.e', 'math.pi')
+
+
+class ParseError(ValueError):
+    """ Raised if an input string is not a valid function. """
+
+
 def parse_variable(li, r, e):
     """ Get value and error of a variable from the input and add it to the dictionaries r and e.
     
@@ -65,96 +50,116 @@ def parse_variable(li, r, e):
     return r, e
       
         
-def get_structure(string):
-    """ Take a string and return the related structure if possible (may raise errors). """
-    level = structure()
-    current_symbol = list()
-    current_depth = 0
-    for i in range(len(string)):
-        if string[i] == '(':
-            level.append(''.join(current_symbol), current_depth)
-            current_symbol = list()
-            level.append(structure(), current_depth)
-            current_depth += 1
-        elif string[i] == ')':
-            level.append(''.join(current_symbol), current_depth)
-            current_symbol = list()
-            current_depth -= 1
-        elif string[i] == ' ':
-            level.append(''.join(current_symbol), current_depth)
-            current_symbol = list()
-        else:
-            current_symbol.append(string[i])
-    level.append(''.join(current_symbol), current_depth)
-    return level.return_as_list()
-
-def get_functions(li, r, e):
-    """ Take a nested list and build together the related functions recursively.
+def tokenize(string):
+    """ Split string into a list of (kind, text) tokens, kind is 'number', 'operator' or 'name'. """
+    tokens = list()
+    pos = 0
+    end = len(string.rstrip())
+    while pos < end:
+        match = TOKEN.match(string, pos)
+        if match is None or match.end() == pos:
+            raise ParseError("Unexpected character at position " + str(pos) + ": " + string[pos:pos+10])
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+class Parser:
+    """ Precedence climbing parser building functions from a token list in one pass.
     
-    Arguments:
-    li -- nested list like returned from structure.return_as_list()
-    r -- dictionary of means
-    e -- dictionary of errors
+    Operators wait on an explicit stack until an operator binding less strongly
+    or a closing bracket follows (shunting yard), so brackets may be nested
+    arbitrarily deep without recursion.
     """
-    if len(li) == 1:
-        if isinstance(li, list):
-            return get_functions(li[0], r, e)
-    if isinstance(li, str) or len(li) == 1:
-        if not isinstance(li, str):
-            li = li[0]
-        try:
-            return Constant(float(li)), r, e
-        except:
-            if li in ('math.e', 'math.pi'):
-                return MathConstant(li), r, e
+
+    def __init__(self, tokens):
+        """ Create a parser for the tokens returned by tokenize(). """
+        self.tokens = tokens
+        self.operands = list()
+        self.operators = list() # (text, binding power, is prefix), '(' or '<function name>(' for a call
+
+    def parse(self):
+        """ Parse all tokens and return the function. """
+        expect_operand = True
+        previous = None
+        for kind, text in self.tokens:
+            call = previous in FUNCTIONS
+            previous = text
+            if expect_operand:
+                if kind == 'number':
+                    self.operands.append(Constant(float(text)))
+                    expect_operand = False
+                elif kind == 'name' and text in FUNCTIONS:
+                    self.operators.append((text, PREFIX_POWER, True))
+                elif kind == 'name':
+                    self.operands.append(MathConstant(text) if text in MATH_CONSTANTS else Variable(text))
+                    expect_operand = False
+                elif text == '(' and call:
+                    self.operators[-1] = self.operators[-1][0] + '('
+                elif text == '(':
+                    self.operators.append('(')
+                elif text == '-':
+                    self.operators.append(('-', PREFIX_POWER, True))
+                elif text != '+':
+                    raise ParseError("Unexpected token " + text)
+            elif kind == 'operator' and text in BINARY:
+                power = BINARY[text]
+                # right associative operators leave an equal operator on the stack waiting
+                self.reduce(power + 1 if text in RIGHT_ASSOCIATIVE else power)
+                self.operators.append((text, power, False))
+                expect_operand = True
+            elif text == ')':
+                self.reduce(0)
+                if not self.operators:
+                    raise ParseError("Unexpected token )")
+                bracket = self.operators.pop()
+                if bracket != '(':
+                    self.operands.append(FUNCTIONS[bracket[:-1]](self.operands.pop()))
             else:
-                if not li in r:
-                    r, e = parse_variable(li, r, e)
-                return Variable(li), r, e                
-    elif li[0] == 'log':
-        f, r, e = get_functions(li[1], r, e)
-        return Logarithm(f), r, e
-    elif li[0] == 'sin':
-        f, r, e = get_functions(li[1], r, e)
-        return Sine(f), r, e
-    elif li[0] == 'cos':
-        f, r, e = get_functions(li[1], r, e)
-        return Cosine(f), r, e
-    elif '+' in li:
-        pos = li.index('+')
-        f1, r, e = get_functions(li[0:pos], r, e)
-        f2, r, e = get_functions(li[pos+1:len(li)], r, e)
-        return Sum(f1, f2), r, e
-    elif '-' in li:
-        pos = li.index('-')
-        if pos != 0:
-            f1, r, e = get_functions(li[0:pos], r, e)
-            f2, r, e = get_functions(li[pos+1:len(li)], r, e)
-            return Difference(f1, f2), r, e
-        f, r, e = get_functions(li[0:pos], r, e)
-        return Negate(f), r, e # ignore the remaining parts
-    elif '*' in li:
-        pos = li.index('*')
-        f1, r, e = get_functions(li[0:pos], r, e)
-        f2, r, e = get_functions(li[pos+1:len(li)], r, e)
-        return Product(f1, f2), r, e
-    elif '/' in li:
-        pos = li.index('/')
-        f1, r, e = get_functions(li[0:pos], r, e)
-        f2, r, e = get_functions(li[pos+1:len(li)], r, e)
-        return Quotient(f1, f2), r, e
-    elif '^' in li:
-        pos = li.index('^')
-        f1, r, e = get_functions(li[0:pos], r, e)
-        f2, r, e = get_functions(li[pos+1:len(li)], r, e)
-        if isinstance(f2.simplify().simplify(), Constant) or isinstance(f2.simplify().simplify(), MathConstant):
-            return PowConstant(f1, f2.simplify().simplify().value), r, e
-        return Pow(f1, f2), r, e
-        
-        
+                raise ParseError("Unexpected token " + text)
+        if expect_operand:
+            raise ParseError("Unexpected end of input")
+        self.reduce(0)
+        if self.operators:
+            raise ParseError("Missing closing bracket")
+        return self.operands.pop()
+
+    def reduce(self, min_power):
+        """ Apply the operators on the stack binding at least as strongly as min_power, up to the next bracket. """
+        while self.operators and not isinstance(self.operators[-1], str) and self.operators[-1][1] >= min_power:
+            text, _, prefix = self.operators.pop()
+            right = self.operands.pop()
+            if prefix:
+                self.operands.append(FUNCTIONS[text](right) if text in FUNCTIONS else Negate(right))
+            else:
+                self.operands.append(self.combine(text, self.operands.pop(), right))
+
+    @staticmethod
+    def combine(operator, left, right):
+        """ Return the function of the binary operator applied to left and right. """
+        if operator == '+':
+            return Sum(left, right)
+        if operator == '-':
+            return Difference(left, right)
+        if operator == '*':
+            return Product(left, right)
+        if operator == '/':
+            return Quotient(left, right)
+        exponent = right.simplify().simplify()
+        if isinstance(exponent, Constant) or isinstance(exponent, MathConstant):
+            return PowConstant(left, exponent.value)
+        return Pow(left, right)
+
+
+def parse_function(string):
+    """ Take a string and return the related function without asking for variables (may raise ParseError). """
+    return Parser(tokenize(string)).parse()
+
+
 def parse(string, replacements, replacements_error):
     """ Take a string and return the related function if there is no error in between. 
     
+    Asks for the value of every variable not yet in replacements.
     Will return Constant(0) at any error, be careful.
     Arguments:
     string -- str of function
@@ -162,14 +167,14 @@ def parse(string, replacements, replacements_error):
     replacements_error -- dictionary of errors
     """
     try:
-        todo_list = get_structure(string)
-        return get_functions(todo_list, replacements, replacements_error)
+        function = parse_function(string)
+    except ParseError as error:
+        print("PARSE ERROR", error)
+        return Constant(0), replacements, replacements_error
     except ZeroDivisionError:
         print("PARSE ERROR Divison by zero")
-    except MathDomainError:
-        print("PARSE ERROR MathDomain")
-    except:
-        print("PARSE ERROR ", sys.exec_info()[0])
-        raise
-    return Constant(0)
-
+        return Constant(0), replacements, replacements_error
+    for name in variables(function):
+        if not name in replacements:
+            replacements, replacements_error = parse_variable(name, replacements, replacements_error)
+    return function, replacements, replacements_error
@@ -0,0 +1,180 @@
+""" Keep parsed formulas, their simplified partial derivatives and compiled sources on disk between runs.
+
+Entries are addressed by a hash of the formula text and of the source of the modules
+which produce them, so changing the code invalidates all entries of older versions.
+"""
+
+import hashlib
+import marshal
+import os
+import pickle
+import sys
+import tempfile
+
+import canonical
+import functions
+import parser
+from functions import compile_code, deserialize, serialize
+
+CACHE_ENVIRONMENT = 'ERROR_CALCULATION_CACHE'
+SUFFIX = '.pickle'
+
+
+def code_version():
+    """ Return a hash of the source of the modules which parse, simplify and derive functions.
+
+    The Python version is part of it, because the entries contain marshalled code objects.
+    batch.py is read by path, it lays out the cached programs but imports this module.
+    """
+    digest = hashlib.sha256(sys.version.encode())
+    paths = [module.__file__ for module in (functions, parser, canonical)]
+    for path in paths + [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batch.py')]:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+class FormulaStore:
+    """ Directory of cache entries, one file per formula, at most max_bytes large in total.
+
+    The modification time of an entry is updated whenever it is used, the least
+    recently used entries are removed first when the directory is too large.
+    Files are written to a temporary name and renamed, so concurrent runs never
+    read half written entries.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 2**20):
+        """ Use (and create) directory for the entries.
+
+        Arguments:
+        directory -- path of the cache directory
+        max_bytes -- size limit of all entries together
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = code_version()
+        self.size = None # of all entries, known after the first eviction check
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, text):
+        """ Return the file name of the entry of the formula text. """
+        key = hashlib.sha256((self.version + '\0' + text).encode()).hexdigest()
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, text):
+        """ Return the entry (dict) stored for the formula text, or None. Unreadable entries are removed. """
+        path = self.path(text)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            self._remove(path)
+            return None
+        if entry.get('text') != text:
+            return None
+        return entry
+
+    def store(self, text, entry):
+        """ Write entry (dict of picklable values) for the formula text and evict old entries if needed. """
+        entry = dict(entry, text=text)
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            os.replace(temporary, self.path(text))
+        except BaseException:
+            self._remove(temporary)
+            raise
+        if self.size is None:
+            self.evict()
+        else:
+            self.size += size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """ Remove the least recently used entries until all entries together fit into max_bytes. """
+        entries = list()
+        for name in os.listdir(self.directory):
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                status = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError: # removed by another run
+                continue
+            entries.append((status.st_mtime, status.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, name in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.directory, name))
+            size -= file_size
+        self.size = size
+
+    def clear(self):
+        self.size = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                self._remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def formula_entry(function, variables, partials, seconds=None):
+    """ Return the entry of a parsed function and its simplified derivatives.
+
+    Arguments:
+    function -- parsed and simplified function
+    variables -- names of the variables of function, in the order of partials
+    partials -- simplified partial derivatives
+    seconds -- simplified second derivatives from functions.simplified_hessian(), or None
+    """
+    entry = {'tree': serialize(function), 'variables': list(variables), 'partials': serialize(*partials)}
+    if seconds is not None:
+        entry['seconds'] = serialize(*seconds)
+    return entry
+
+
+def read_entry(entry):
+    """ Return function and variables of an entry from formula_entry().
+
+    The stored derivatives are put into the caches of the function and its partial derivatives,
+    so functions.simplified_derivative() and simplified_hessian() do not derive again.
+    """
+    function, = deserialize(entry['tree'])
+    names = entry['variables']
+    partials = deserialize(entry['partials'])
+    for variable, partial in zip(names, partials):
+        function._cache[('derivative', variable)] = partial
+    if 'seconds' in entry:
+        seconds = iter(deserialize(entry['seconds']))
+        for i in range(len(names)):
+            for j in range(i, len(names)):
+                partials[i]._cache[('derivative', names[j])] = next(seconds)
+    return function, names
+
+
+def program_entry(functions, variables, source):
+    """ Return the entry of a batch.Program.
+
+    Arguments:
+    functions -- parsed and simplified functions
+    variables -- names of the variables of every function (list of lists)
+    source -- Python source from batch.program_source() or its code object
+    """
+    code = compile_code(source, 'program') if isinstance(source, str) else source
+    return {'trees': serialize(*functions), 'variables': [list(names) for names in variables], 'code': marshal.dumps(code)}
+
+
+def read_program_entry(entry):
+    """ Return functions, variables and the compiled code object of an entry from program_entry(). """
+    return deserialize(entry['trees']), entry['variables'], marshal.loads(entry['code'])
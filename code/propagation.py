@@ -0,0 +1,201 @@
+""" Error propagation beyond independent variables, evaluated for many rows at once (needs NumPy). """
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from functions import compile_function, compile_gradient, compile_hessian, variables
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("This kind of error propagation needs NumPy")
+
+
+def all_variables(functions):
+    """ Return the names of the variables used by any of the functions, in order of appearance. """
+    return list(dict.fromkeys(name for function in functions for name in variables(function)))
+
+
+def jacobian(functions, replacements, names=None):
+    """ Return the Jacobian of the functions by the variables for one or many rows.
+
+    Arguments:
+    functions -- list of functions (outputs)
+    replacements -- dictionary of variable name to mean, scalars or 1-D arrays of equal length (rows)
+    names -- variable names giving the column order, all_variables(functions) if None
+    Returns an array of shape (outputs, variables), or (rows, outputs, variables) for array means.
+    """
+    _require_numpy()
+    if names is None:
+        names = all_variables(functions)
+    means = {name: numpy.asarray(replacements[name], dtype=float) for name in names}
+    shape = numpy.broadcast_shapes(*[mean.shape for mean in means.values()])
+    rows = list()
+    for function in functions:
+        partials = compile_gradient(function, names, arrays=True)(means) if names else ()
+        rows.append([numpy.broadcast_to(partial, shape) for partial in partials])
+    matrix = numpy.array(rows, dtype=float).reshape((len(functions), len(names)) + shape)
+    return numpy.moveaxis(matrix, (0, 1), (-2, -1))
+
+
+def covariance_matrix(errors, names, correlations=None):
+    """ Return the covariance matrix of the variables from their errors and correlation coefficients.
+
+    Arguments:
+    errors -- dictionary of variable name to error (standard deviation)
+    names -- variable names giving the order of rows and columns
+    correlations -- dictionary of (name, name) to correlation coefficient, missing pairs are uncorrelated
+    """
+    _require_numpy()
+    sigma = numpy.array([errors[name] for name in names], dtype=float)
+    correlation = numpy.identity(len(names))
+    index = {name: i for i, name in enumerate(names)}
+    for (a, b), rho in (correlations or {}).items():
+        correlation[index[a], index[b]] = correlation[index[b], index[a]] = rho
+    return correlation * numpy.outer(sigma, sigma)
+
+
+def propagate_covariance(functions, replacements, covariance, names=None):
+    """ Return the covariance matrix of the functions, J covariance J^T.
+
+    Arguments:
+    functions -- list of functions (outputs)
+    replacements -- dictionary of variable name to mean, scalars or 1-D arrays of equal length (rows)
+    covariance -- covariance matrix of the variables in the order of names, shape (variables, variables)
+                  or (rows, variables, variables)
+    names -- variable names giving the order of covariance, all_variables(functions) if None
+    Returns an array of shape (outputs, outputs), or (rows, outputs, outputs) for array means.
+    The errors of the functions are the square roots of the diagonal.
+    """
+    matrix = jacobian(functions, replacements, names)
+    covariance = numpy.asarray(covariance, dtype=float)
+    return numpy.einsum('...ij,...jk,...lk->...il', matrix, covariance, matrix)
+
+
+def hessian(function, replacements, names=None):
+    """ Return the Hessian of function by the variables for one or many rows.
+
+    Only the upper triangle is computed, the lower one is mirrored.
+    Arguments:
+    function -- function to derive twice
+    replacements -- dictionary of variable name to mean, scalars or 1-D arrays of equal length (rows)
+    names -- variable names giving the order of rows and columns, variables(function) if None
+    Returns an array of shape (variables, variables), or (rows, variables, variables) for array means.
+    """
+    _require_numpy()
+    if names is None:
+        names = variables(function)
+    means = {name: numpy.asarray(replacements[name], dtype=float) for name in names}
+    shape = numpy.broadcast_shapes(*[mean.shape for mean in means.values()])
+    matrix = numpy.zeros(shape + (len(names), len(names)))
+    if names:
+        seconds = iter(compile_hessian(function, names, arrays=True)(means))
+        for i in range(len(names)):
+            for j in range(i, len(names)):
+                matrix[..., i, j] = matrix[..., j, i] = next(seconds)
+    return matrix
+
+
+def propagate_second_order(function, replacements, covariance, names=None):
+    """ Return mean and variance of function to second order for normally distributed variables.
+
+    mean = f + tr(H covariance) / 2 and variance = g^T covariance g + tr(H covariance H covariance) / 2,
+    with the gradient g and the Hessian H at the means.
+    Arguments:
+    function -- function
+    replacements -- dictionary of variable name to mean, scalars or 1-D arrays of equal length (rows)
+    covariance -- covariance matrix of the variables in the order of names, shape (variables, variables)
+                  or (rows, variables, variables)
+    names -- variable names giving the order of covariance, variables(function) if None
+    """
+    if names is None:
+        names = variables(function)
+    gradient = jacobian([function], replacements, names)[..., 0, :]
+    matrix = hessian(function, replacements, names)
+    covariance = numpy.asarray(covariance, dtype=float)
+    means = {name: numpy.asarray(replacements[name], dtype=float) for name in names}
+    value = compile_function(function, arrays=True)(means)
+    product = matrix @ covariance
+    mean = value + numpy.trace(product, axis1=-2, axis2=-1) / 2
+    variance = (numpy.einsum('...i,...ij,...j->...', gradient, covariance, gradient)
+                + numpy.trace(product @ product, axis1=-2, axis2=-1) / 2)
+    return mean, variance
+
+
+def error_contributions(function, replacements, errors, names=None):
+    """ Return the contribution (partial derivative * error)^2 of every variable to the variance of function.
+
+    The variance to first order for independent variables is the sum of the contributions.
+    Arguments:
+    function -- function
+    replacements -- dictionary of variable name to mean, scalars or 1-D arrays of equal length (rows)
+    errors -- dictionary of variable name to error, scalars or arrays like the means
+    names -- variables to return, variables(function) if None
+    Returns a dictionary of variable name to contribution, arrays for array means.
+    """
+    _require_numpy()
+    if names is None:
+        names = variables(function)
+    if not names:
+        return dict()
+    means = {name: numpy.asarray(replacements[name], dtype=float) for name in names}
+    partials = compile_gradient(function, names, arrays=True)(means)
+    return {name: (partial * numpy.asarray(errors[name], dtype=float))**2 for name, partial in zip(names, partials)}
+
+
+class ErrorBudget:
+    """ Shares of the variables in the variance of one function, aggregated over any number of rows.
+
+    The share of a variable in a row is its contribution from error_contributions() divided by the
+    sum of all contributions. Rows with variance 0 are left out. Budgets of parts of the rows can be
+    merged like errorhelper.RunningStatistics.
+    """
+
+    def __init__(self, names):
+        _require_numpy()
+        self.names = list(names)
+        self.rows = 0
+        self.share_sums = numpy.zeros(len(self.names))
+        self.max_shares = numpy.zeros(len(self.names))
+        self.max_contributions = numpy.zeros(len(self.names))
+        self.dominant = numpy.zeros(len(self.names), dtype=int) # rows in which the variable has the largest share
+
+    def add(self, contributions):
+        """ Add the rows of contributions (dictionary of variable name to contribution, scalars or 1-D arrays). """
+        if not self.names:
+            return
+        matrix = numpy.array(numpy.broadcast_arrays(*[numpy.asarray(contributions[name], dtype=float)
+                                                      for name in self.names]), ndmin=2)
+        matrix = matrix.reshape(len(self.names), -1)
+        variance = matrix.sum(axis=0)
+        kept = variance > 0
+        matrix = matrix[:, kept]
+        if not matrix.shape[1]:
+            return
+        shares = matrix / variance[kept]
+        self.rows += shares.shape[1]
+        self.share_sums += shares.sum(axis=1)
+        numpy.maximum(self.max_shares, shares.max(axis=1), out=self.max_shares)
+        numpy.maximum(self.max_contributions, matrix.max(axis=1), out=self.max_contributions)
+        self.dominant += numpy.bincount(shares.argmax(axis=0), minlength=len(self.names))
+
+    def merge(self, other):
+        """ Add the rows of other (ErrorBudget of the same variables) to self. """
+        self.rows += other.rows
+        self.share_sums += other.share_sums
+        numpy.maximum(self.max_shares, other.max_shares, out=self.max_shares)
+        numpy.maximum(self.max_contributions, other.max_contributions, out=self.max_contributions)
+        self.dominant += other.dominant
+
+    def ranking(self, top=None):
+        """ Return one dictionary per variable, largest mean share first, only the top ones if top is given.
+
+        The keys are variable, mean_share, max_share, max_contribution and dominant (number of rows).
+        """
+        mean_shares = self.share_sums / self.rows if self.rows else numpy.zeros(len(self.names))
+        order = sorted(range(len(self.names)), key=lambda i: (-mean_shares[i], -self.dominant[i]))
+        return [{'variable': self.names[i], 'mean_share': float(mean_shares[i]), 'max_share': float(self.max_shares[i]),
+                 'max_contribution': float(self.max_contributions[i]), 'dominant': int(self.dominant[i])}
+                for i in order[:top]]
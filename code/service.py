@@ -0,0 +1,153 @@
+""" Answer JSON lines requests for values and errors, on stdin/stdout or a Unix socket.
+
+Each request is one JSON object per line:
+    {"id": 1, "formula": "x*sin(y)", "means": {"x": 1, "y": 2}, "errors": {"x": 0.1}, "order": 1}
+Means and errors are numbers or lists of equal length (one entry per row), missing errors
+are 0 and "id" and "order" are optional. The answer to it is one line
+    {"id": 1, "value": ..., "error": ...}
+or {"id": 1, "failure": "<message>"}. Answers may come in a different order than the requests.
+
+Parsed and derived formulas are kept in a bounded cache shared by all requests and clients.
+Requests with many rows are evaluated in a pool of worker processes, so they do not hold up
+the small ones.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import ERROR_SUFFIX, Formula
+from cache import LRUCache
+
+HEAVY_ROWS = 1000 # requests with more rows go to the worker processes
+LINE_LIMIT = 2**26 # longest request line in bytes on the socket
+
+formulas = LRUCache(256)
+
+
+def get_formula(text, order=1):
+    """ Return the batch.Formula of text from the cache, parsing and compiling it on a miss. """
+    formula = formulas.get((text, order))
+    if formula is None:
+        formula = Formula(text, order=order)
+        formulas.put((text, order), formula)
+    return formula
+
+
+def rows(request):
+    """ Return the number of rows of request (0 if all means are numbers). """
+    return max([len(mean) for mean in request.get('means', {}).values() if isinstance(mean, list)], default=0)
+
+
+def evaluate(request):
+    """ Return the answer (dict) to request (dict), without its id. """
+    formula = get_formula(request['formula'], request.get('order', 1))
+    means = request.get('means', {})
+    errors = request.get('errors', {})
+    missing = [name for name in formula.variables if name not in means]
+    if missing:
+        raise ValueError("no mean for variable " + ', '.join(missing))
+    size = rows(request)
+    if size == 0:
+        value, error = formula.evaluate(means, {name: errors.get(name, 0.0) for name in formula.variables})
+        return {'value': float(value), 'error': float(error)}
+    columns = dict()
+    for name in formula.variables:
+        columns[name] = means[name] if isinstance(means[name], list) else [means[name]] * size
+        error = errors.get(name, 0.0)
+        columns[name + ERROR_SUFFIX] = error if isinstance(error, list) else [error] * size
+    values, errors = formula.evaluate_chunk(columns, size)
+    return {'value': values, 'error': errors}
+
+
+class Service:
+    """ Answers requests from any number of connections, see the module description. """
+
+    def __init__(self, processes=None):
+        """ Create the service, processes is the number of worker processes (default: one per CPU). """
+        self.processes = processes
+        self.pool = None
+
+    async def answer(self, line):
+        """ Return the answer line (str, without newline) to a request line. """
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            if rows(request) > HEAVY_ROWS:
+                if self.pool is None:
+                    # forked workers would inherit the client sockets and keep them open after they are closed here
+                    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                    self.pool = ProcessPoolExecutor(self.processes, multiprocessing.get_context(method))
+                answer = await asyncio.get_running_loop().run_in_executor(self.pool, evaluate, request)
+            else:
+                answer = evaluate(request)
+        except Exception as error: # every failure is reported to the client, the service keeps running
+            answer = {'failure': type(error).__name__ + ': ' + str(error)}
+        answer['id'] = request_id
+        return json.dumps(answer)
+
+    async def handle(self, readline, write):
+        """ Answer every request line concurrently.
+
+        Arguments:
+        readline -- coroutine function returning the next line (bytes), empty at the end
+        write -- function sending an answer line (str)
+        """
+        tasks = set()
+
+        async def respond(line):
+            write(await self.answer(line) + '\n')
+
+        while True:
+            line = await readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.ensure_future(respond(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def serve_stdio(self):
+        """ Answer the requests on stdin on stdout until stdin is closed.
+
+        stdin is read by a thread, which works for pipes, terminals and files alike.
+        """
+        loop = asyncio.get_running_loop()
+
+        def write(line):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+        await self.handle(lambda: loop.run_in_executor(None, sys.stdin.buffer.readline), write)
+
+    async def serve_socket(self, path):
+        """ Answer the requests of every client connecting to the Unix socket at path, forever. """
+        async def connection(reader, writer):
+            try:
+                await self.handle(reader.readline, lambda line: writer.write(line.encode()))
+                await writer.drain()
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(connection, path, limit=LINE_LIMIT)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def serve(path=None, processes=None):
+    """ Run the service on the Unix socket at path, or on stdin/stdout if path is None. """
+    service = Service(processes)
+    try:
+        asyncio.run(service.serve_socket(path) if path else service.serve_stdio())
+    finally:
+        service.close()
@@ -0,0 +1,79 @@
+""" Scan value and error of formulas over ranges of one or two variables (needs NumPy).
+
+The result is written as a NumPy .npz file with the arrays <variable> (the grid of
+every swept variable), value_<n> and error_<n> (one per formula, same shape as the grid).
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from batch import Program
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("Sweeps need NumPy")
+
+
+def parse_range(text):
+    """ Return (name, means, error) of a range given as name=start:stop:count[,error].
+
+    The count values run from start to stop inclusively, the error is 0 if missing.
+    """
+    _require_numpy()
+    try:
+        name, value = text.split('=')
+        value, _, error = value.partition(',')
+        start, stop, count = value.split(':')
+        return name.strip(), numpy.linspace(float(start), float(stop), int(count)), float(error or 0)
+    except ValueError:
+        raise ValueError("range " + repr(text) + " is not of the form name=start:stop:count[,error]")
+
+
+def parse_fixed(text):
+    """ Return (name, mean, error) of a variable given as name=mean[,error], the error is 0 if missing. """
+    try:
+        name, value = text.split('=')
+        mean, _, error = value.partition(',')
+        return name.strip(), float(mean), float(error or 0)
+    except ValueError:
+        raise ValueError("value " + repr(text) + " is not of the form name=mean[,error]")
+
+
+def sweep(formulas, ranges, replacements, error_replacements, order=1):
+    """ Return a dictionary of the grids of the swept variables and the values and errors of the formulas on them.
+
+    All grid points of all formulas are evaluated in one vectorized call.
+    Arguments:
+    formulas -- list of formula strings or a batch.Program
+    ranges -- list of (name, means, error) of the swept variables, one or two
+    replacements -- dictionary of variable name to mean of the fixed variables
+    error_replacements -- dictionary of variable name to error of the fixed variables
+    order -- 2 for second order error propagation, see batch.propagate()
+    """
+    _require_numpy()
+    if not 1 <= len(ranges) <= 2:
+        raise ValueError("sweep one or two variables")
+    grids = numpy.meshgrid(*[means for _, means, _ in ranges], indexing='ij')
+    means = dict(replacements)
+    errors = dict(error_replacements)
+    result = dict()
+    for (name, _, error), grid in zip(ranges, grids):
+        means[name] = grid
+        errors[name] = error
+        result[name] = grid
+    program = formulas if isinstance(formulas, Program) else Program(formulas, order=order)
+    missing = [name for name in program.variables if name not in means]
+    if missing:
+        raise ValueError("no value for variable " + ', '.join(missing))
+    for i, (value, error) in enumerate(program.evaluate(means, errors)):
+        result['value_' + str(i+1)] = numpy.broadcast_to(value, grids[0].shape)
+        result['error_' + str(i+1)] = numpy.broadcast_to(error, grids[0].shape)
+    return result
+
+
+def save_sweep(path, result):
+    """ Write the result of sweep() compressed to path (.npz). """
+    numpy.savez_compressed(path, **result)
@@ -0,0 +1,243 @@
+""" Flat postfix representation of functions, evaluated with one loop over two arrays.
+
+A Tape holds an opcode per step (array of bytes) and its operand (array of ints): an
+index into the pool of constants, the slot of a variable, the exponent of a power or a
+register. Subtrees used more than once are computed once, stored in a register and
+loaded again, so a tape is as long as the number of distinct nodes, not of the
+expanded tree.
+
+    >>> x = Variable('x')
+    >>> tape = Tape.from_function(Sum(Product(x, Sine(Variable('y'))), x))
+    >>> tape.evaluate({'x': 2.0, 'y': 0.0})
+    2.0
+"""
+
+from array import array
+from math import cos, log, sin
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from functions import (Constant, Cosine, Difference, Logarithm, MathConstant, Negate, Pow, PowConstant, Product,
+                       Quotient, Sine, Sum, Variable, postorder)
+
+CONSTANT, VARIABLE, LOAD, STORE = 0, 1, 2, 3
+SUM, DIFFERENCE, PRODUCT, QUOTIENT, POW = 4, 5, 6, 7, 8
+NEGATE, SINE, COSINE, LOGARITHM, POW_CONSTANT = 9, 10, 11, 12, 13
+
+OPCODES = {Sum: SUM, Difference: DIFFERENCE, Product: PRODUCT, Quotient: QUOTIENT, Pow: POW,
+           Negate: NEGATE, Sine: SINE, Cosine: COSINE, Logarithm: LOGARITHM, PowConstant: POW_CONSTANT}
+CLASSES = {opcode: cls for cls, opcode in OPCODES.items()}
+
+
+class Tape:
+    """ Postfix program of one function. """
+
+    __slots__ = ('codes', 'operands', 'pool', 'values', 'variables', 'registers', 'depth')
+
+    def __init__(self):
+        self.codes = array('B')
+        self.operands = array('i')
+        self.pool = list() # Constant, MathConstant or exponents of PowConstant, for to_function()
+        self.values = list() # numeric values of pool
+        self.variables = list() # names, a variable's operand is its index here
+        self.registers = 0
+        self.depth = 0 # largest stack size during evaluation
+
+    @classmethod
+    def from_function(cls, function):
+        """ Return the tape of function. """
+        tape = cls()
+        pool = dict()
+        slots = dict()
+        shared = set()
+        seen = set()
+        for node in postorder(function):
+            for child in node.children():
+                if child in seen and child.children():
+                    shared.add(child)
+                seen.add(child)
+        registers = dict()
+        size = 0
+        stack = [(function, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node in registers:
+                tape._emit(LOAD, registers[node])
+                size += 1
+            elif isinstance(node, (Constant, MathConstant)):
+                if node not in pool:
+                    pool[node] = tape._constant(node, node.value)
+                tape._emit(CONSTANT, pool[node])
+                size += 1
+            elif isinstance(node, Variable):
+                if node.name not in slots:
+                    slots[node.name] = len(tape.variables)
+                    tape.variables.append(node.name)
+                tape._emit(VARIABLE, slots[node.name])
+                size += 1
+            elif not expanded:
+                stack.append((node, True))
+                for child in reversed(node.children()):
+                    stack.append((child, False))
+                continue
+            else:
+                opcode = OPCODES.get(type(node))
+                if opcode is None:
+                    raise TypeError(type(node).__name__ + " can not be put on a tape")
+                if opcode == POW_CONSTANT:
+                    tape._emit(opcode, tape._constant(node.exponent, node.exponent))
+                else:
+                    tape._emit(opcode, 0)
+                size -= len(node.children()) - 1
+                if node in shared:
+                    registers[node] = len(registers)
+                    tape._emit(STORE, registers[node])
+            tape.depth = max(tape.depth, size)
+        tape.registers = len(registers)
+        return tape
+
+    def _emit(self, opcode, operand):
+        self.codes.append(opcode)
+        self.operands.append(operand)
+
+    def _constant(self, entry, value):
+        self.pool.append(entry)
+        self.values.append(value)
+        return len(self.pool) - 1
+
+    def to_function(self):
+        """ Return the function of the tape, built from the node classes. """
+        stack = list()
+        registers = [None] * self.registers
+        for opcode, operand in zip(self.codes, self.operands):
+            if opcode == CONSTANT:
+                stack.append(self.pool[operand])
+            elif opcode == VARIABLE:
+                stack.append(Variable(self.variables[operand]))
+            elif opcode == LOAD:
+                stack.append(registers[operand])
+            elif opcode == STORE:
+                registers[operand] = stack[-1]
+            elif opcode == POW_CONSTANT:
+                stack[-1] = PowConstant(stack[-1], self.pool[operand])
+            elif opcode >= NEGATE:
+                stack[-1] = CLASSES[opcode](stack[-1])
+            else:
+                right = stack.pop()
+                stack[-1] = CLASSES[opcode](stack[-1], right)
+        return stack[0]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def evaluate(self, replacements, stack=None):
+        """ Return the value of the tape for the values of the variables (dict of name to number).
+
+        Arguments:
+        stack -- list to work in, reused between calls to avoid allocations, a new one if None
+        """
+        return self.evaluate_slots([replacements[name] for name in self.variables], stack)
+
+    def evaluate_slots(self, slots, stack=None):
+        """ Return the value of the tape for the values of the variables in the order of self.variables. """
+        if stack is None:
+            stack = list()
+        values = self.values
+        registers = self.registers # stored values are at the bottom of stack
+        if len(stack) < registers:
+            stack.extend([0.0] * registers)
+        del stack[registers:]
+        push = stack.append
+        pop = stack.pop
+        for opcode, operand in zip(self.codes, self.operands):
+            if opcode == VARIABLE:
+                push(slots[operand])
+            elif opcode == CONSTANT:
+                push(values[operand])
+            elif opcode == PRODUCT:
+                right = pop()
+                stack[-1] = stack[-1] * right
+            elif opcode == SUM:
+                right = pop()
+                stack[-1] = stack[-1] + right
+            elif opcode == DIFFERENCE:
+                right = pop()
+                stack[-1] = stack[-1] - right
+            elif opcode == QUOTIENT:
+                right = pop()
+                stack[-1] = stack[-1] / right
+            elif opcode == POW_CONSTANT:
+                stack[-1] = stack[-1] ** values[operand]
+            elif opcode == LOAD:
+                push(stack[operand])
+            elif opcode == STORE:
+                stack[operand] = stack[-1]
+            elif opcode == NEGATE:
+                stack[-1] = -stack[-1]
+            elif opcode == SINE:
+                stack[-1] = sin(stack[-1])
+            elif opcode == COSINE:
+                stack[-1] = cos(stack[-1])
+            elif opcode == LOGARITHM:
+                stack[-1] = log(stack[-1])
+            else: # POW
+                right = pop()
+                stack[-1] = stack[-1] ** right
+        return stack[registers]
+
+    def evaluate_rows(self, columns):
+        """ Return the list of values for every row of columns (dict of variable name to list of values).
+
+        All rows are evaluated in the same stack.
+        """
+        stack = list()
+        slots = [columns[name] for name in self.variables]
+        rows = len(slots[0]) if slots else len(next(iter(columns.values()), ()))
+        return [self.evaluate_slots([slot[row] for slot in slots], stack) for row in range(rows)]
+
+    def scratch(self, rows):
+        """ Return a NumPy scratch array for evaluate_arrays() of rows rows. """
+        return numpy.empty((self.depth + self.registers, rows))
+
+    def evaluate_arrays(self, columns, scratch=None):
+        """ Return the array of values for columns (dict of variable name to array), needs NumPy.
+
+        Every step writes into a row of scratch (from scratch(), a new one if None), so
+        nothing is allocated per node and scratch can be reused for the next chunk.
+        """
+        slots = [numpy.asarray(columns[name], dtype=float) for name in self.variables]
+        rows = len(slots[0]) if slots else 1
+        if scratch is None or scratch.shape[1] != rows:
+            scratch = self.scratch(rows)
+        values = self.values
+        registers = self.depth
+        top = -1
+        for opcode, operand in zip(self.codes, self.operands):
+            if opcode == VARIABLE:
+                top += 1
+                scratch[top] = slots[operand]
+            elif opcode == CONSTANT:
+                top += 1
+                scratch[top] = values[operand]
+            elif opcode == LOAD:
+                top += 1
+                scratch[top] = scratch[registers + operand]
+            elif opcode == STORE:
+                scratch[registers + operand] = scratch[top]
+            elif opcode < NEGATE:
+                top -= 1
+                BINARY[opcode](scratch[top], scratch[top+1], out=scratch[top])
+            elif opcode == POW_CONSTANT:
+                numpy.power(scratch[top], values[operand], out=scratch[top])
+            else:
+                UNARY[opcode](scratch[top], out=scratch[top])
+        return scratch[0].copy()
+
+
+if numpy is not None:
+    BINARY = {SUM: numpy.add, DIFFERENCE: numpy.subtract, PRODUCT: numpy.multiply, QUOTIENT: numpy.divide,
+              POW: numpy.power}
+    UNARY = {NEGATE: numpy.negative, SINE: numpy.sin, COSINE: numpy.cos, LOGARITHM: numpy.log}
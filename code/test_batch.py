@@ -0,0 +1,114 @@
+""" Tests of the batch mode. Run python -m pytest. """
+
+import csv
+import io
+from math import isnan, log, sqrt
+
+import pytest
+
+from batch import Formula, Program, numpy, program_source, read_chunks, read_rows, run_batch, run_budget
+from propagation import ErrorBudget
+
+DATA = 'run,x,x_error,y,y_error\nA,1,0.1,2,\nB,-1,0.1,0,0.2\nC,4,,0.5,0.5\n'
+
+
+def _run(tmp_path, formulas, data=DATA, name='data.csv', **arguments):
+    path = tmp_path / name
+    path.write_text(data)
+    output = io.StringIO()
+    run_batch(formulas, read_rows(str(path)), output, **arguments)
+    return list(csv.reader(io.StringIO(output.getvalue())))
+
+
+def test_values_and_errors(tmp_path):
+    lines = _run(tmp_path, ['x*y', 'y+1'], chunk_size=2)
+    assert lines[0] == ['row', 'value_1', 'error_1', 'value_2', 'error_2']
+    assert [line[0] for line in lines[1:]] == ['0', '1', '2']
+    values = [[float(field) for field in line[1:]] for line in lines[1:]]
+    assert values[0] == pytest.approx([2.0, 0.2, 3.0, 0.0])
+    assert values[1] == pytest.approx([0.0, 0.2, 1.0, 0.2])
+    assert values[2] == pytest.approx([2.0, 2.0, 1.5, 0.5])
+
+
+def test_undefined_rows_are_nan(tmp_path):
+    lines = _run(tmp_path, ['log(x)', '1/y', 'x+1'])
+    assert float(lines[1][1]) == pytest.approx(0.0)
+    assert isnan(float(lines[2][1]))
+    assert float(lines[3][1]) == pytest.approx(log(4))
+    assert float(lines[1][3]) == pytest.approx(0.5)
+    assert float(lines[2][3]) in (float('inf'), float('-inf')) or isnan(float(lines[2][3]))
+    assert [float(line[5]) for line in lines[1:]] == [2.0, 0.0, 5.0]
+
+
+def test_json_lines(tmp_path):
+    data = '{"x": 3, "x_error": 0.5, "label": "first"}\n\n{"x": 1}\n'
+    lines = _run(tmp_path, ['x^2'], data, 'data.jsonl')
+    assert [[float(field) for field in line[1:]] for line in lines[1:]] == [[9.0, 3.0], [1.0, 0.0]]
+
+
+def test_formula_without_variables(tmp_path):
+    lines = _run(tmp_path, ['2*3'])
+    assert [line[1:] for line in lines[1:]] == [['6.0', '0.0']] * 3
+
+
+def test_second_order(tmp_path):
+    lines = _run(tmp_path, ['x^2'], 'x,x_error\n2,0.1\n', order=2)
+    value, error = float(lines[1][1]), float(lines[1][2])
+    assert value == pytest.approx(4.01)
+    assert error == pytest.approx(sqrt(0.4**2 + 2 * 0.01**2))
+
+
+def test_only_needed_columns_are_converted():
+    rows = [{'x': '1', 'x_error': '', 'label': 'a b'}, {'x': '2', 'note': 'c'}]
+    assert list(read_chunks(rows, 10, ['x'])) == [(2, {'x': [1.0, 2.0], 'x_error': [0.0, 0.0]})]
+    with pytest.raises(ValueError):
+        list(read_chunks(rows, 10))
+
+
+@pytest.mark.parametrize('order', [1, 2])
+def test_program_matches_single_formulas(order):
+    formulas = ['sin(x*y)+1', 'sin(x*y)*z', 'log(z)/x', '4']
+    program = Program(formulas, order=order)
+    assert program.variables == ['x', 'y', 'z']
+    means, errors = {'x': 1.5, 'y': 0.5, 'z': 2.0}, {'x': 0.1, 'y': 0.2, 'z': 0.3}
+    for text, (value, error) in zip(formulas, program.evaluate(means, errors)):
+        expected = Formula(text, order=order).evaluate(means, errors)
+        assert (value, error) == pytest.approx(expected)
+
+
+def test_common_subexpressions_are_computed_once():
+    program = Program(['sin(x*y)+1', 'sin(x*y)*z'])
+    source = program_source(program.functions, program.names)
+    assert source.count('_sin(') == 1
+    assert source.count('_cos(') == 1
+
+
+@pytest.mark.skipif(numpy is None, reason="needs NumPy")
+def test_budget(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text('x,x_error,y,y_error,label\n1,0.3,2,0.4,a\n1,1,2,0,b\n1,0,2,0,c\n')
+    output = io.StringIO()
+    run_budget(['x+y', 'x*y'], read_rows(str(path)), output, chunk_size=2, top=1)
+    lines = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert [(line['formula'], line['rank'], line['variable']) for line in lines] == [('1', '1', 'x'), ('2', '1', 'x')]
+    first = lines[0]
+    assert float(first['mean_share']) == pytest.approx((0.36 + 1.0) / 2)
+    assert float(first['max_share']) == 1.0
+    assert float(first['max_contribution']) == pytest.approx(1.0)
+    assert (first['dominant'], first['rows']) == ('1', '2')
+    assert float(lines[1]['mean_share']) == pytest.approx((0.36 / (0.36 + 0.16) + 1.0) / 2)
+
+
+@pytest.mark.skipif(numpy is None, reason="needs NumPy")
+def test_merged_budgets_match_one_budget():
+    contributions = {'x': numpy.array([0.1, 0.0, 2.0, 0.5]), 'y': numpy.array([0.3, 0.0, 1.0, 0.5])}
+    whole = ErrorBudget(['x', 'y'])
+    whole.add(contributions)
+    first, second = ErrorBudget(['x', 'y']), ErrorBudget(['x', 'y'])
+    first.add({name: values[:2] for name, values in contributions.items()})
+    second.add({name: values[2:] for name, values in contributions.items()})
+    first.merge(second)
+    for merged, expected in zip(first.ranking(), whole.ranking()):
+        assert merged == pytest.approx(expected)
+    assert whole.rows == 3
+    assert [line['variable'] for line in whole.ranking()] == ['y', 'x']
@@ -0,0 +1,50 @@
+""" Tests of canonicalization. Run python -m pytest. """
+
+from math import isclose
+
+import pytest
+
+from canonical import canonicalize, node_count, shrink
+from parser import parse_function
+
+POINT = {'x': 1.3, 'y': 0.7, 'z': 2.1}
+
+
+@pytest.mark.parametrize('text', [
+    'x*sin(y)+x',
+    '(x*y)^2*x/y',
+    '2*x+x*3-y/x',
+    'log(x*y)/(z-y)^3',
+    '((x-y)^2)^0.5',
+    '(x^0.5)^2*sin(x*y)^2',
+    '-x^2+z^y',
+    'x*x/y*x-2*math.pi*3*z',
+])
+def test_canonicalize_and_shrink_keep_value(text):
+    function = parse_function(text).simplify().simplify()
+    value = function.evaluate(POINT)
+    assert isclose(canonicalize(function).evaluate(POINT), value)
+    assert isclose(shrink(function).evaluate(POINT), value)
+    assert node_count(shrink(function)) <= node_count(function)
+
+
+def test_like_terms_and_powers_are_collected():
+    assert canonicalize(parse_function('2*x+x*3')) is canonicalize(parse_function('5*x'))
+    assert canonicalize(parse_function('x*x/y*x')) is canonicalize(parse_function('x^3/y'))
+    assert canonicalize(parse_function('y*x*z')) is canonicalize(parse_function('z*y*x'))
+
+
+def test_root_of_square_is_not_folded():
+    assert canonicalize(parse_function('((x-y)^2)^0.5')).evaluate({'x': 1.0, 'y': 3.0}) == 2.0
+
+
+def _chain(leaf, depth=3000):
+    return ''.join('sin(y*' if i % 2 else 'cos(y*' for i in range(depth)) + leaf + ')' * depth
+
+
+def test_deep_factors():
+    function = parse_function(_chain('x') + '*' + _chain('z'))
+    point = {'x': 0.3, 'y': 0.5, 'z': 0.4}
+    assert isclose(canonicalize(function).evaluate(point), function.evaluate(point))
+    derivative = parse_function(_chain('y')).derivate('y').simplify().simplify()
+    assert isclose(shrink(derivative).evaluate(point), derivative.evaluate(point))
@@ -0,0 +1,105 @@
+""" Tests of the statistics of errorhelper. Run python -m pytest. """
+
+import io
+from array import array
+from math import sqrt
+
+import pytest
+
+from errorhelper import (RunningStatistics, calculate_grouped, calculate_mean_and_error,
+                         calculate_mean_and_error_streaming, csv_ranges, read_binary_chunks, read_csv_range,
+                         read_text_chunks, write_table)
+
+VALUES = [1.5, 2.25, -0.5, 3.0, 2.0, 1e3, 0.125]
+
+
+def test_running_statistics_match_two_pass():
+    mean = sum(VALUES) / len(VALUES)
+    variant = sum((value - mean)**2 for value in VALUES) / (len(VALUES) - 1)
+    single = RunningStatistics()
+    for value in VALUES:
+        single.add(value)
+    chunked = RunningStatistics()
+    chunked.add_chunk(VALUES[:3])
+    chunked.add_chunk([])
+    chunked.add_chunk(VALUES[3:])
+    for statistics in (single, chunked):
+        assert statistics.count == len(VALUES)
+        assert statistics.mean == pytest.approx(mean)
+        assert statistics.variant == pytest.approx(variant)
+        assert statistics.error == pytest.approx(sqrt(variant / len(VALUES)))
+
+
+def test_merge_of_parts():
+    first, second = RunningStatistics(), RunningStatistics()
+    first.add_chunk(VALUES[:2])
+    second.add_chunk(VALUES[2:])
+    first.merge(second)
+    first.merge(RunningStatistics())
+    whole = RunningStatistics()
+    whole.add_chunk(VALUES)
+    assert (first.count, first.mean) == (whole.count, pytest.approx(whole.mean))
+    assert first.square_sum == pytest.approx(whole.square_sum)
+
+
+def test_streaming_files(tmp_path, capsys):
+    expected = calculate_mean_and_error(VALUES)
+    text = tmp_path / 'values.txt'
+    text.write_text('1.5 2.25\n-0.5\n3.0 2.0 1e3 0.125\n')
+    binary = tmp_path / 'values.bin'
+    binary.write_bytes(array('d', VALUES).tobytes())
+    assert [len(chunk) for chunk in read_text_chunks(text, 3)] == [3, 4]
+    assert [list(chunk) for chunk in read_binary_chunks(binary, 3)] == [VALUES[:3], VALUES[3:6], VALUES[6:]]
+    for chunks in (read_text_chunks(text, 3), read_binary_chunks(binary, 3)):
+        assert calculate_mean_and_error_streaming(chunks) == pytest.approx(expected)
+    empty = tmp_path / 'empty.bin'
+    empty.write_bytes(b'')
+    assert list(read_binary_chunks(empty)) == []
+
+
+def _table(tmp_path, lines):
+    path = tmp_path / 'data.csv'
+    path.write_text('run,x,label,y\n' + ''.join(lines))
+    return str(path)
+
+
+LINES = ['AB'[i % 3 == 0] + ',' + str(i * 0.5) + ',text ' + str(i) + ',' + ('' if i % 4 else str(i)) + '\n'
+         for i in range(40)]
+
+
+@pytest.mark.parametrize('chunk_bytes', [1, 7, 64, 10**6])
+def test_byte_ranges_read_every_line_once(tmp_path, chunk_bytes):
+    path = _table(tmp_path, LINES)
+    header, ranges = csv_ranges(path, chunk_bytes)
+    assert header == ['run', 'x', 'label', 'y']
+    rows = [row for start, end in ranges for row in read_csv_range(path, start, end)]
+    assert [','.join(row) + '\n' for row in rows] == LINES
+
+
+@pytest.mark.parametrize('chunk_bytes, processes', [(10**6, 1), (13, 1), (50, 2)])
+def test_grouped_statistics_merge_ranges(tmp_path, chunk_bytes, processes):
+    path = _table(tmp_path, LINES)
+    result = calculate_grouped(path, 'run', chunk_bytes=chunk_bytes, processes=processes)
+    assert sorted(result) == [('A', 'x'), ('A', 'y'), ('B', 'x'), ('B', 'y')] # label holds no numbers
+    for group in 'AB':
+        xs = [i * 0.5 for i in range(40) if 'AB'[i % 3 == 0] == group]
+        expected = RunningStatistics()
+        expected.add_chunk(xs)
+        assert result[(group, 'x')].count == len(xs)
+        assert result[(group, 'x')].mean == pytest.approx(expected.mean)
+        assert result[(group, 'x')].variant == pytest.approx(expected.variant)
+    assert result[('B', 'y')].count == len([i for i in range(40) if i % 4 == 0 and i % 3 == 0])
+    output = io.StringIO()
+    write_table(result, output)
+    assert output.getvalue().splitlines()[0] == 'group,column,count,mean,error,variant,derivation,error_of_error'
+    assert len(output.getvalue().splitlines()) == 5
+
+
+def test_selected_columns_must_be_numbers(tmp_path):
+    path = _table(tmp_path, LINES + ['A,1,x,2\n', 'B,2,y,oops\n'])
+    assert calculate_grouped(path, columns=['x'], processes=1)[('', 'x')].count == 42
+    for chunk_bytes in (10**6, 20):
+        with pytest.raises(ValueError, match="'oops' of column y in line 43 "):
+            calculate_grouped(path, columns=['x', 'y'], chunk_bytes=chunk_bytes, processes=1)
+    with pytest.raises(ValueError, match='no column z'):
+        calculate_grouped(path, columns=['z'])
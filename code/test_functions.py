@@ -0,0 +1,98 @@
+""" Tests of the function nodes: batch and compiled evaluation, simplification and rendering. Run python -m pytest. """
+
+from math import isclose
+
+import pytest
+
+from functions import (ELLIPSIS, Product, Sine, Variable, compile_function, compile_gradient, evaluate_batch, numpy,
+                       value_and_gradient, variables)
+from parser import parse_function
+
+POINT = {'x': 1.3, 'y': 0.7, 'z': 2.1}
+
+FORMULAS = [
+    'x*sin(y)+x',
+    'cos(x)^2+sin(x)^2',
+    '(x*y)^2*x/y',
+    '2*x+x*3-y/x',
+    'log(x*y)/(z-y)^3',
+    '((x-y)^2)^0.5',
+    '(x^0.5)^2*sin(x*y)^2',
+    '-x^2+z^y',
+]
+
+
+def test_evaluate_batch_without_rows():
+    assert len(evaluate_batch(parse_function('2'), [])) == 0
+    assert len(evaluate_batch(parse_function('x'), [])) == 0
+
+
+def test_evaluate_batch_rows_and_columns():
+    function = parse_function('x*y+1')
+    rows = [{'x': 1.0, 'y': 2.0}, {'x': 2.0, 'y': 0.5}]
+    assert list(evaluate_batch(function, rows)) == [3.0, 2.0]
+    assert list(evaluate_batch(function, {'x': [1.0, 2.0], 'y': [2.0, 0.5]})) == [3.0, 2.0]
+
+
+def test_evaluate_batch_constant_has_one_value_per_row():
+    assert list(evaluate_batch(parse_function('2+x-x'), {'x': [1.0, 2.0, 3.0]})) == [2.0, 2.0, 2.0]
+
+
+@pytest.mark.skipif(numpy is None, reason="needs NumPy")
+def test_evaluate_batch_returns_array():
+    values = evaluate_batch(parse_function('x^2'), {'x': [1.0, 2.0]})
+    assert isinstance(values, numpy.ndarray)
+    assert values.tolist() == [1.0, 4.0]
+
+
+@pytest.mark.parametrize('text', FORMULAS)
+def test_compiled_matches_interpreted(text):
+    function = parse_function(text).simplify().simplify()
+    assert isclose(compile_function(function)(POINT), function.evaluate(POINT))
+    names = variables(function)
+    _, gradient = value_and_gradient(function, POINT)
+    for name, partial in zip(names, compile_gradient(function, names)(POINT)):
+        assert isclose(partial, gradient[name], rel_tol=1e-9, abs_tol=1e-12)
+        assert isclose(partial, function.derivate(name).evaluate(POINT), rel_tol=1e-9, abs_tol=1e-12)
+
+
+
+@pytest.mark.parametrize('text', FORMULAS)
+def test_simplify_keeps_value(text):
+    function = parse_function(text)
+    assert isclose(function.simplify().simplify().evaluate(POINT), function.evaluate(POINT))
+
+
+def test_equal_functions_are_one_object():
+    assert parse_function('x*sin(y)') is parse_function('x * sin(y)')
+    with pytest.raises(AttributeError):
+        parse_function('x').name = 'y'
+
+
+def test_root_of_square_is_not_folded():
+    point = {'x': 1.0, 'y': 3.0}
+    assert parse_function('((x-y)^2)^0.5').simplify().evaluate(point) == 2.0
+    assert parse_function('(x^2)^3').simplify() is parse_function('x^6')
+
+
+@pytest.mark.parametrize('text', FORMULAS + ['+'.join('x*' + str(i) for i in range(60))])
+def test_elided_latex_fits_into_limit(text):
+    function = parse_function(text)
+    full = function.latex()
+    for limit in range(len(full) + 2):
+        elided = function.latex(limit=limit)
+        assert len(elided) <= len(full)
+        assert len(elided) <= max(limit, len(ELLIPSIS))
+    assert function.latex(limit=len(full)) == full
+
+
+def test_elided_latex_of_deep_trees():
+    text = parse_function('+'.join('x*' + str(i) for i in range(100))).latex(limit=80)
+    assert len(text) <= 80
+    assert text.endswith('+x\\cdot 98.0)+x\\cdot 99.0)')
+    function = Variable('x')
+    for _ in range(5000):
+        function = Sine(Product(Variable('y'), function))
+    text = function.latex(limit=100)
+    assert 80 <= len(text) <= 100
+    assert text.startswith('\\sin{(y\\cdot \\sin{(')
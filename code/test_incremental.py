@@ -0,0 +1,46 @@
+""" Tests of incremental re-evaluation. Run python -m pytest. """
+
+from math import sqrt
+
+import pytest
+
+from functions import value_and_gradient
+from incremental import IncrementalEvaluator
+from parser import parse_function
+
+FUNCTION = parse_function('x*sin(y)+log(z)*x^2-y/z')
+
+
+def _expected(means, errors):
+    value, gradient = value_and_gradient(FUNCTION, means)
+    return value, sqrt(sum((gradient[name] * errors[name])**2 for name in gradient)), gradient
+
+
+def test_updates_match_value_and_gradient():
+    evaluator = IncrementalEvaluator(FUNCTION)
+    means = {'x': 1.5, 'y': 0.3, 'z': 2.0}
+    errors = {'x': 0.1, 'y': 0.2, 'z': 0.05}
+    steps = [('x', 2.5, None), ('y', -1.0, None), ('z', None, 0.3), ('x', 2.5, 0.4), ('z', 4.0, 0.0)]
+    assert evaluator.update(means, errors) == pytest.approx(_expected(means, errors)[:2])
+    for name, mean, error in steps:
+        if mean is not None:
+            means[name] = mean
+        if error is not None:
+            errors[name] = error
+        value, error = evaluator.update(means, errors)
+        expected_value, expected_error, gradient = _expected(means, errors)
+        assert value == pytest.approx(expected_value)
+        assert error == pytest.approx(expected_error)
+        assert evaluator.gradient == pytest.approx(gradient)
+
+
+def test_only_affected_nodes_are_evaluated():
+    evaluator = IncrementalEvaluator(FUNCTION)
+    means = {'x': 1.5, 'y': 0.3, 'z': 2.0}
+    errors = {'x': 0.1, 'y': 0.2, 'z': 0.05}
+    evaluator.update(means, errors)
+    assert evaluator.evaluated == len(evaluator.nodes)
+    evaluator.update(dict(means, y=0.4), errors)
+    assert 0 < evaluator.evaluated < len(evaluator.nodes)
+    evaluator.update(dict(means, y=0.4), dict(errors, x=1.0))
+    assert evaluator.evaluated == 0
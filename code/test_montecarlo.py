@@ -0,0 +1,44 @@
+""" Tests of Monte Carlo error propagation. Run python -m pytest. """
+
+import tracemalloc
+
+import pytest
+
+from montecarlo import monte_carlo, numpy
+from parser import parse_function
+
+pytestmark = pytest.mark.skipif(numpy is None, reason="needs NumPy")
+
+FUNCTION = parse_function('x*sin(y)+log(x)')
+MEANS = {'x': 2.0, 'y': 1.0}
+ERRORS = {'x': 0.1, 'y': 0.1}
+
+
+def test_same_seed_gives_same_result():
+    first = monte_carlo(FUNCTION, MEANS, ERRORS, 3 * 10**4, seed=7, chunk_size=10**4, processes=1)
+    assert first == monte_carlo(FUNCTION, MEANS, ERRORS, 3 * 10**4, seed=7, chunk_size=10**4, processes=1)
+    assert first == monte_carlo(FUNCTION, MEANS, ERRORS, 3 * 10**4, seed=7, chunk_size=10**4, processes=2)
+    assert first != monte_carlo(FUNCTION, MEANS, ERRORS, 3 * 10**4, seed=8, chunk_size=10**4, processes=1)
+    assert first['samples'] == 3 * 10**4
+    assert first['mean'] == pytest.approx(2 * numpy.sin(1) + numpy.log(2), abs=0.03)
+
+
+def test_samples_outside_the_domain_are_left_out():
+    result = monte_carlo(parse_function('log(x)'), {'x': 0.0}, {'x': 1.0}, 10**4, seed=1, processes=1)
+    assert 0 < result['invalid'] < 10**4
+    assert result['samples'] + result['invalid'] == 10**4
+
+
+def test_memory_does_not_grow_with_samples():
+    peaks = list()
+    for samples in (2 * 10**5, 8 * 10**5):
+        tracemalloc.start()
+        monte_carlo(FUNCTION, MEANS, ERRORS, samples, seed=1, chunk_size=10**5, processes=1, keep=1000)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < 1.3 * peaks[0]
+
+
+def test_no_samples():
+    with pytest.raises(ValueError):
+        monte_carlo(FUNCTION, MEANS, ERRORS, 0)
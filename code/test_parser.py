@@ -0,0 +1,42 @@
+""" Tests of the parser. Run python -m pytest. """
+
+from math import cos, isclose, sin
+
+import pytest
+
+from functions import PowConstant, Sine, Variable
+from parser import ParseError, parse_function
+
+POINT = {'x': 1.3, 'y': 0.7, 'z': 2.1}
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('sin(x)^2', sin(1.3)**2),
+    ('cos(x)^2+sin(x)^2', 1.0),
+    ('log(math.e)^2', 1.0),
+    ('sin x^2', sin(1.3**2)),
+    ('-sin(x)^2', -sin(1.3)**2),
+    ('x-y-z', 1.3 - 0.7 - 2.1),
+    ('x/y/z', 1.3 / 0.7 / 2.1),
+    ('2^3^2', 512.0),
+    ('-x^2', -1.3**2),
+    ('2*x^2', 2 * 1.3**2),
+    ('sin(cos(x)^2)*2', 2 * sin(cos(1.3)**2)),
+])
+def test_precedence(text, expected):
+    assert isclose(parse_function(text).evaluate(POINT), expected)
+
+
+def test_function_call_is_one_operand():
+    assert parse_function('sin(x)^2') is PowConstant(Sine(Variable('x')), 2)
+
+
+@pytest.mark.parametrize('text', ['sin(x', 'x+', '(x))', 'sin()', 'x $ y'])
+def test_invalid_input(text):
+    with pytest.raises(ParseError):
+        parse_function(text)
+
+
+def test_deep_input():
+    text = '(' * 3000 + 'x' + ')' * 3000 + '+1' * 3000
+    assert parse_function(text).evaluate({'x': 1.0}) == 3001.0
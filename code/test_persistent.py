@@ -0,0 +1,67 @@
+""" Tests of the on-disk cache of formulas. Run python -m pytest. """
+
+import os
+
+import batch
+import persistent
+from persistent import FormulaStore, formula_entry, read_entry
+from parser import parse_function
+
+
+def _entry(text):
+    function = parse_function(text)
+    return formula_entry(function, ['x'], [function.derivate('x')])
+
+
+def test_warm_hit(tmp_path):
+    store = FormulaStore(str(tmp_path))
+    assert store.load('x*sin(x)') is None
+    store.store('x*sin(x)', _entry('x*sin(x)'))
+    entry = FormulaStore(str(tmp_path)).load('x*sin(x)')
+    function, names = read_entry(entry)
+    assert function is parse_function('x*sin(x)')
+    assert names == ['x']
+    assert function._cache[('derivative', 'x')] is parse_function('x*sin(x)').derivate('x')
+
+
+def test_programs_are_not_compiled_again(tmp_path, monkeypatch):
+    formulas = ['x*sin(y)', 'log(x)+y^2']
+    first = batch.Program(formulas, FormulaStore(str(tmp_path)), order=2)
+    monkeypatch.setattr(batch, 'program_source', None) # a miss would call it
+    second = batch.Program(formulas, FormulaStore(str(tmp_path)), order=2)
+    means, errors = {'x': 1.5, 'y': 0.5}, {'x': 0.1, 'y': 0.2}
+    assert second.evaluate(means, errors) == first.evaluate(means, errors)
+    assert second.names == [['x', 'y'], ['x', 'y']]
+
+
+def test_entries_of_other_versions_are_not_used(tmp_path, monkeypatch):
+    FormulaStore(str(tmp_path)).store('x*sin(x)', _entry('x*sin(x)'))
+    monkeypatch.setattr(persistent, 'code_version', lambda: 'other')
+    store = FormulaStore(str(tmp_path))
+    assert store.load('x*sin(x)') is None
+    store.store('x*sin(x)', _entry('x*sin(x)'))
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_unreadable_entries_are_removed(tmp_path):
+    store = FormulaStore(str(tmp_path))
+    with open(store.path('x'), 'wb') as f:
+        f.write(b'no pickle')
+    assert store.load('x') is None
+    assert not os.path.exists(store.path('x'))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    store = FormulaStore(str(tmp_path))
+    texts = ['x+' + str(i) for i in range(4)]
+    for i, text in enumerate(texts):
+        store.store(text, _entry(text))
+        os.utime(store.path(text), (1000 + i, 1000 + i))
+    size = os.path.getsize(store.path(texts[0]))
+    assert store.load(texts[0]) is not None # used now, so the newest
+    store.max_bytes = int(3.5 * size)
+    store.evict()
+    assert [os.path.exists(store.path(text)) for text in texts] == [True, False, True, True]
+    assert store.size <= store.max_bytes
+    store.clear()
+    assert os.listdir(tmp_path) == []
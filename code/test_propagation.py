@@ -0,0 +1,56 @@
+""" Tests of error propagation with covariances and to second order. Run python -m pytest. """
+
+from math import sqrt
+
+import pytest
+
+from parser import parse_function
+from batch import Program
+from propagation import covariance_matrix, jacobian, numpy, propagate_covariance, propagate_second_order
+
+pytestmark = pytest.mark.skipif(numpy is None, reason="needs NumPy")
+
+
+def test_covariance_of_sum_and_difference():
+    functions = [parse_function('x+y'), parse_function('x-y')]
+    covariance = covariance_matrix({'x': 0.3, 'y': 0.4}, ['x', 'y'], {('x', 'y'): 0.5})
+    result = propagate_covariance(functions, {'x': 1.0, 'y': 2.0}, covariance, ['x', 'y'])
+    assert result == pytest.approx(numpy.array([[0.09 + 0.16 + 0.12, 0.09 - 0.16],
+                                                [0.09 - 0.16, 0.09 + 0.16 - 0.12]]))
+
+
+def test_independent_variables_give_quadrature_sum():
+    function = parse_function('x*y')
+    covariance = covariance_matrix({'x': 0.1, 'y': 0.2}, ['x', 'y'])
+    result = propagate_covariance([function], {'x': 3.0, 'y': 2.0}, covariance)
+    assert sqrt(result[0, 0]) == pytest.approx(sqrt((2.0 * 0.1)**2 + (3.0 * 0.2)**2))
+
+
+def test_rows():
+    means = {'x': numpy.array([1.0, 2.0, 4.0]), 'y': 1.0}
+    matrix = jacobian([parse_function('x^2*y')], means)
+    assert matrix.shape == (3, 1, 2)
+    assert matrix[:, 0, 0].tolist() == [2.0, 4.0, 8.0]
+    assert matrix[:, 0, 1].tolist() == [1.0, 4.0, 16.0]
+    result = propagate_covariance([parse_function('x^2*y')], means, numpy.diag([0.01, 0.0]))
+    assert result[:, 0, 0] == pytest.approx([0.04, 0.16, 0.64])
+
+
+def test_second_order_of_normal_variables():
+    covariance = numpy.diag([0.3**2, 0.2**2])
+    mean, variance = propagate_second_order(parse_function('x^2'), {'x': 2.0}, covariance[:1, :1])
+    assert mean == pytest.approx(4.0 + 0.09)
+    assert variance == pytest.approx(4 * 4.0 * 0.09 + 2 * 0.09**2)
+    mean, variance = propagate_second_order(parse_function('x*y'), {'x': 2.0, 'y': 3.0}, covariance, ['x', 'y'])
+    assert mean == pytest.approx(6.0)
+    assert variance == pytest.approx(9.0 * 0.09 + 4.0 * 0.04 + 0.09 * 0.04)
+
+
+def test_second_order_of_batches_matches():
+    means = {'x': numpy.array([1.0, 2.0]), 'y': numpy.array([0.5, 3.0])}
+    errors = {'x': 0.1, 'y': 0.2}
+    function = parse_function('log(x)*y+y/x')
+    [(value, error)] = Program(['log(x)*y+y/x'], order=2).evaluate(means, errors)
+    mean, variance = propagate_second_order(function, means, numpy.diag([0.01, 0.04]), ['x', 'y'])
+    assert value == pytest.approx(mean)
+    assert error == pytest.approx(numpy.sqrt(variance))
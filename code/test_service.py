@@ -0,0 +1,65 @@
+""" Tests of the JSON lines service. Run python -m pytest. """
+
+import asyncio
+import json
+from math import sin
+
+import pytest
+
+import service
+from service import Service, evaluate
+
+
+def test_single_values():
+    answer = evaluate({'formula': 'x*sin(y)', 'means': {'x': 2, 'y': 1}, 'errors': {'x': 0.1}})
+    assert answer['value'] == pytest.approx(2 * sin(1))
+    assert answer['error'] == pytest.approx(sin(1) * 0.1)
+
+
+def test_rows():
+    answer = evaluate({'formula': 'x+y', 'means': {'x': [1, 2], 'y': 3}, 'errors': {'x': [0.3, 0.0], 'y': 0.4}})
+    assert answer['value'] == [4.0, 5.0]
+    assert answer['error'] == pytest.approx([0.5, 0.4])
+    assert evaluate({'formula': '2', 'means': {'x': [1, 2]}}) == {'value': [2.0, 2.0], 'error': [0.0, 0.0]}
+
+
+def test_formulas_are_cached():
+    evaluate({'formula': 'x^3', 'means': {'x': 1}})
+    formula = service.formulas.get(('x^3', 1))
+    assert formula is not None
+    assert service.get_formula('x^3') is formula
+
+
+def test_answers_and_failures():
+    lines = [b'{"id": 1, "formula": "x^2", "means": {"x": 3}, "errors": {"x": 0.5}}\n', b'\n',
+             b'{"id": 2, "formula": "x^2", "means": {}}\n', b'{"id": 3, "formula": "x+", "means": {"x": 1}}\n',
+             b'no json\n', b'']
+    written = list()
+
+    async def readline():
+        return lines.pop(0)
+
+    asyncio.run(Service(processes=1).handle(readline, written.append))
+    answers = {answer['id']: answer for answer in map(json.loads, written)}
+    assert answers[1] == {'id': 1, 'value': 9.0, 'error': 3.0}
+    assert 'ValueError' in answers[2]['failure']
+    assert 'ParseError' in answers[3]['failure']
+    assert 'failure' in answers[None]
+    assert len(written) == 4
+
+
+def test_large_requests_go_to_worker_processes(monkeypatch):
+    monkeypatch.setattr(service, 'HEAVY_ROWS', 1)
+    lines = [json.dumps({'id': 5, 'formula': 'x*y', 'means': {'x': [1, 2, 3], 'y': 2}}).encode() + b'\n', b'']
+    written = list()
+
+    async def readline():
+        return lines.pop(0)
+
+    worker = Service(processes=1)
+    try:
+        asyncio.run(worker.handle(readline, written.append))
+        assert worker.pool is not None
+    finally:
+        worker.close()
+    assert json.loads(written[0]) == {'id': 5, 'value': [2.0, 4.0, 6.0], 'error': [0.0, 0.0, 0.0]}
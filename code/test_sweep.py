@@ -0,0 +1,30 @@
+""" Tests of sweeps. Run python -m pytest. """
+
+import pytest
+
+from sweep import numpy, parse_fixed, parse_range, save_sweep, sweep
+
+pytestmark = pytest.mark.skipif(numpy is None, reason="needs NumPy")
+
+
+def test_sweep_over_a_grid(tmp_path):
+    ranges = [parse_range('x=0:2:3,0.1'), parse_range('y=1:2:2')]
+    name, mean, error = parse_fixed('r=2,0.5')
+    result = sweep(['r*x*y', 'x+1'], ranges, {name: mean}, {name: error})
+    assert result['x'].tolist() == [[0.0, 0.0], [1.0, 1.0], [2.0, 2.0]]
+    assert result['value_1'].tolist() == [[0.0, 0.0], [2.0, 4.0], [4.0, 8.0]]
+    assert result['value_2'].shape == (3, 2)
+    assert result['error_2'] == pytest.approx(numpy.full((3, 2), 0.1))
+    assert result['error_1'][1, 1] == pytest.approx(numpy.hypot(2 * 2 * 0.1, 1 * 2 * 0.5))
+    save_sweep(tmp_path / 'scan.npz', result)
+    with numpy.load(tmp_path / 'scan.npz') as saved:
+        assert saved['value_1'].tolist() == result['value_1'].tolist()
+
+
+def test_invalid_sweeps():
+    with pytest.raises(ValueError):
+        parse_range('x=0:1')
+    with pytest.raises(ValueError):
+        parse_fixed('r')
+    with pytest.raises(ValueError):
+        sweep(['x*y'], [parse_range('x=0:1:2')], {}, {})
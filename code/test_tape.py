@@ -0,0 +1,57 @@
+""" Tests of the postfix tape. Run python -m pytest. """
+
+from math import isclose
+
+import pytest
+
+from functions import Cosine, Product, Variable
+from parser import parse_function
+from tape import LOAD, Tape, numpy
+
+POINT = {'x': 1.3, 'y': 0.7, 'z': 2.1}
+
+FORMULAS = [
+    'x*sin(y)+x',
+    '(x*sin(y))^2+x*sin(y)-log(x*sin(y))',
+    '-x^2+z^y/(y-math.pi)',
+    'cos(x)^0.5*2.5',
+    '3',
+]
+
+
+@pytest.mark.parametrize('text', FORMULAS)
+def test_round_trip(text):
+    function = parse_function(text)
+    tape = Tape.from_function(function)
+    assert tape.to_function() is function
+    assert isclose(tape.evaluate(POINT), function.evaluate(POINT))
+
+
+def test_shared_subtrees_are_stored_once():
+    function = parse_function('(x*sin(y))^2+x*sin(y)-log(x*sin(y))')
+    tape = Tape.from_function(function)
+    assert tape.registers == 1
+    assert list(tape.codes).count(LOAD) == 2
+    assert len(tape) == 11
+
+
+def test_rows_and_arrays():
+    function = parse_function('x*sin(y)+x/y')
+    tape = Tape.from_function(function)
+    columns = {'x': [1.0, 2.0, 3.0], 'y': [0.5, 1.0, 1.5]}
+    expected = [function.evaluate({'x': x, 'y': y}) for x, y in zip(columns['x'], columns['y'])]
+    assert tape.evaluate_rows(columns) == pytest.approx(expected)
+    if numpy is not None:
+        scratch = tape.scratch(3)
+        assert tape.evaluate_arrays(columns, scratch).tolist() == pytest.approx(expected)
+        assert tape.evaluate_arrays(columns, scratch).tolist() == pytest.approx(expected)
+
+
+def test_deep_function():
+    function = Variable('x')
+    for _ in range(20000):
+        function = Cosine(Product(function, Variable('y')))
+    tape = Tape.from_function(function)
+    assert tape.depth == 2
+    assert tape.to_function() is function
+    assert isclose(tape.evaluate({'x': 0.5, 'y': 0.3}), function.evaluate({'x': 0.5, 'y': 0.3}))
@@ -0,0 +1,46 @@
+""" Tests of numbers with errors. Run python -m pytest. """
+
+import math
+from math import sqrt
+
+import pytest
+
+from uncertain import Uncertain, UncertainArray, cos, numpy, sin
+
+
+def test_independent_errors_add_in_quadrature():
+    x = Uncertain.variable(2.0, 0.1)
+    y = Uncertain.variable(3.0, 0.2)
+    z = x * y
+    assert z.value == 6.0
+    assert z.error == pytest.approx(sqrt((3.0 * 0.1)**2 + (2.0 * 0.2)**2))
+    assert (x + 1).error == 0.1
+    assert (2 ** x).error == pytest.approx(math.log(2.0) * 4.0 * 0.1)
+
+
+def test_correlations_are_tracked():
+    x = Uncertain.variable(2.0, 0.1, 'x')
+    assert (x - x).value == 0.0
+    assert (x - x).error == 0.0
+    assert (x + x).error == pytest.approx(0.2)
+    assert (x / x).error == pytest.approx(0.0)
+    assert (sin(x)**2 + cos(x)**2).error == pytest.approx(0.0, abs=1e-15)
+    assert (x - Uncertain.variable(2.0, 0.1, 'x')).error == 0.0
+    assert (x - Uncertain.variable(2.0, 0.1)).error == pytest.approx(sqrt(0.02))
+    y = x * 3
+    assert x.covariance(y) == pytest.approx(3 * 0.01)
+    assert x.correlation(y) == pytest.approx(1.0)
+    assert x.correlation(-y) == pytest.approx(-1.0)
+
+
+@pytest.mark.skipif(numpy is None, reason="needs NumPy")
+def test_arrays_are_combined_element_by_element():
+    a = UncertainArray.variable([1.0, 2.0, 3.0], [0.1, 0.2, 0.3])
+    assert (a * a).error.tolist() == pytest.approx([0.2, 0.8, 1.8])
+    assert (a - a).error.tolist() == [0.0, 0.0, 0.0]
+    assert (a[0] + a[1]).error == pytest.approx(sqrt(0.01 + 0.04))
+    assert (a[0] + a[0]).error == pytest.approx(0.2)
+    assert (a[1:] - a[1:]).error.tolist() == [0.0, 0.0]
+    assert a[1:].covariance(a[1:]).tolist() == pytest.approx([0.04, 0.09])
+    with pytest.raises(ValueError):
+        a[1:] + a[:2]
@@ -0,0 +1,242 @@
+""" Numbers with errors for plain Python arithmetic instead of formula strings.
+
+    >>> x = Uncertain.variable(2.0, 0.1, 'x')
+    >>> y = Uncertain.variable(3.0, 0.2, 'y')
+    >>> x * y + sin(x)
+    6.909297426825682 +/- 0.4761963583469045
+
+Every number keeps a sparse map of input variable to its contribution (partial derivative
+times error of the input). Contributions of the same input add up, so correlations are
+tracked: x - x is exactly 0 +/- 0. The values and partial derivatives come from apply()
+and partials() of the nodes in functions.py. UncertainArray holds many numbers in NumPy
+arrays and is combined element by element.
+"""
+
+from itertools import count
+from math import sqrt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from functions import (Cosine, Difference, Logarithm, Negate, Pow, PowConstant, Product, Quotient, Sine, Sum,
+                       Variable)
+
+A = Variable('a')
+B = Variable('b')
+SUM = Sum(A, B)
+DIFFERENCE = Difference(A, B)
+PRODUCT = Product(A, B)
+QUOTIENT = Quotient(A, B)
+POW = Pow(A, B)
+NEGATE = Negate(A)
+SINE = Sine(A)
+COSINE = Cosine(A)
+LOGARITHM = Logarithm(A)
+
+_inputs = count()
+
+
+class Uncertain:
+    """ Value with linear uncertainty, defined by its contributions per input variable. """
+
+    __slots__ = ('value', 'contributions')
+
+    def __init__(self, value, contributions=None):
+        """ Create a number from value and contributions (dict of input to partial derivative * error). """
+        self.value = value
+        self.contributions = contributions or {}
+
+    @classmethod
+    def variable(cls, value, error, name=None):
+        """ Return a new independent input variable with value and error (standard deviation).
+
+        Inputs with the same name are the same variable, without a name every call creates a new one.
+        """
+        return cls(value, {next(_inputs) if name is None else name: error})
+
+    @property
+    def error(self):
+        return sqrt(sum(contribution**2 for contribution in self.contributions.values()))
+
+    def covariance(self, other):
+        """ Return the covariance of self and other (Uncertain). """
+        return sum(contribution * other.contributions[key]
+                   for key, contribution in self.contributions.items() if key in other.contributions)
+
+    def correlation(self, other):
+        return self.covariance(other) / (self.error * other.error)
+
+    def __repr__(self):
+        return str(self.value) + ' +/- ' + str(self.error)
+
+    def __add__(self, other):
+        return combine(SUM, self, other)
+
+    def __radd__(self, other):
+        return combine(SUM, other, self)
+
+    def __sub__(self, other):
+        return combine(DIFFERENCE, self, other)
+
+    def __rsub__(self, other):
+        return combine(DIFFERENCE, other, self)
+
+    def __mul__(self, other):
+        return combine(PRODUCT, self, other)
+
+    def __rmul__(self, other):
+        return combine(PRODUCT, other, self)
+
+    def __truediv__(self, other):
+        return combine(QUOTIENT, self, other)
+
+    def __rtruediv__(self, other):
+        return combine(QUOTIENT, other, self)
+
+    def __pow__(self, other):
+        if isinstance(other, (int, float)):
+            return combine(PowConstant(A, other), self)
+        return combine(POW, self, other)
+
+    def __rpow__(self, other):
+        return combine(POW, other, self)
+
+    def __neg__(self):
+        return combine(NEGATE, self)
+
+    def __pos__(self):
+        return self
+
+
+class ElementKey:
+    """ Contribution key of the elements of an input array at the positions of an array or of one element.
+
+    indices holds the number of the input element at every position (a 0-d array for one element),
+    so elements taken out of an array keep their identity.
+    """
+
+    __slots__ = ('input', 'indices', 'identity')
+
+    def __init__(self, input, indices):
+        self.input = input
+        self.indices = numpy.asarray(indices)
+        self.identity = (input, self.indices.shape, self.indices.tobytes())
+
+    def __eq__(self, other):
+        return isinstance(other, ElementKey) and self.identity == other.identity
+
+    def __hash__(self):
+        return hash(self.identity)
+
+    def __repr__(self):
+        return 'ElementKey(' + repr(self.input) + ', ' + repr(self.indices.tolist()) + ')'
+
+    def take(self, shape, index):
+        """ Return the key of the positions index of an array of shape with this key. """
+        return ElementKey(self.input, numpy.broadcast_to(self.indices, shape)[index])
+
+    def overlaps(self, other):
+        """ Return whether other is a different key with elements of the same input in common. """
+        return (self.input == other.input and self != other
+                and numpy.intersect1d(self.indices, other.indices).size > 0)
+
+
+class UncertainArray(Uncertain):
+    """ Many values with linear uncertainty in NumPy arrays, combined element by element.
+
+    The contributions are arrays of the same length as the values. Element i of an input
+    created by UncertainArray.variable() is a separate variable from element j. Elements
+    taken out by indexing may be combined with each other, but not with an array holding
+    the same elements at other positions (ValueError).
+    """
+
+    __slots__ = ()
+
+    def __init__(self, value, contributions=None):
+        if numpy is None:
+            raise ImportError("UncertainArray needs NumPy")
+        value = numpy.asarray(value, dtype=float)
+        super().__init__(value, {key: numpy.broadcast_to(contribution, value.shape)
+                                 for key, contribution in (contributions or {}).items()})
+
+    @classmethod
+    def variable(cls, value, error, name=None):
+        """ Return new independent input variables with values and errors (sequences or arrays). """
+        value = numpy.asarray(value, dtype=float)
+        key = ElementKey(next(_inputs) if name is None else name, numpy.arange(value.size).reshape(value.shape))
+        return cls(value, {key: numpy.broadcast_to(numpy.asarray(error, dtype=float), value.shape)})
+
+    @property
+    def error(self):
+        square_sum = numpy.zeros(self.value.shape)
+        for contribution in self.contributions.values():
+            square_sum += contribution**2
+        return numpy.sqrt(square_sum)
+
+    def covariance(self, other):
+        """ Return the covariances of the elements of self and the corresponding elements of other. """
+        covariance = numpy.zeros(numpy.broadcast_shapes(self.value.shape, numpy.shape(other.value)))
+        for key, contribution in self.contributions.items():
+            if key in other.contributions:
+                covariance += contribution * other.contributions[key]
+        return covariance
+
+    def __len__(self):
+        return len(self.value)
+
+    def __getitem__(self, index):
+        """ Return element index as Uncertain, or a slice as UncertainArray. """
+        contributions = {key.take(self.value.shape, index) if isinstance(key, ElementKey) else key: contribution[index]
+                         for key, contribution in self.contributions.items()}
+        if numpy.ndim(self.value[index]) == 0:
+            return Uncertain(float(self.value[index]), {key: float(value) for key, value in contributions.items()})
+        return UncertainArray(self.value[index], contributions)
+
+
+def combine(node, *operands):
+    """ Return node applied to the operands (Uncertain or numbers) with the propagated contributions.
+
+    Arguments:
+    node -- function whose children are the operands, e.g. Product(Variable('a'), Variable('b'))
+    """
+    values = [operand.value if isinstance(operand, Uncertain) else operand for operand in operands]
+    contributions = dict()
+    for operand, partial in zip(operands, node.partials(*values)):
+        if not isinstance(operand, Uncertain):
+            continue
+        for key, contribution in operand.contributions.items():
+            if key in contributions:
+                contributions[key] = contributions[key] + partial * contribution
+            else:
+                contributions[key] = partial * contribution
+    _check_elements(contributions)
+    if any(isinstance(operand, UncertainArray) or isinstance(value, getattr(numpy, 'ndarray', ()))
+           for operand, value in zip(operands, values)):
+        return UncertainArray(node.apply(*values), contributions)
+    return Uncertain(node.apply(*values), contributions)
+
+
+def _check_elements(contributions):
+    """ Raise ValueError if contributions hold elements of an input array at different positions. """
+    keys = dict()
+    for key in contributions:
+        if isinstance(key, ElementKey):
+            keys.setdefault(key.input, list()).append(key)
+    for same_input in keys.values():
+        for i, key in enumerate(same_input):
+            if any(key.overlaps(other) for other in same_input[i+1:]):
+                raise ValueError("elements of input " + repr(key.input) + " are combined at different positions")
+
+
+def sin(x):
+    return combine(SINE, x)
+
+
+def cos(x):
+    return combine(COSINE, x)
+
+
+def log(x):
+    return combine(LOGARITHM, x)